@@ -10,7 +10,7 @@ from pytz import timezone
 from datetime import datetime
 import pandas_market_calendars as mcal
 
-from src import params, predict, train, util
+from src import params, util
 
 
 tz = timezone('US/Eastern')
@@ -47,7 +47,7 @@ def main():
     initial_allocation_2 = amount_TSLA / initial_amount
 
     # Get params
-    data_params, env_params, model_params, train_params, model_name = params.main()
+    data_params, env_params, model_params, train_params, run_params, model_name = params.main()
     
     # Last business dates
     nyse = mcal.get_calendar('NYSE')
@@ -78,7 +78,9 @@ def main():
     create_date = datetime.fromtimestamp(create_time)
     st.write('Model has been trained on', create_date - pd.to_timedelta(4, unit='h'))
 
+    # The model modules are imported on first use, not on page load
     if st.button('Predict'):
+        from src import predict
         next_allocation = predict.main(
             data_params,
             env_params,
@@ -93,12 +95,14 @@ def main():
         st.write(next_allocation.tail(1))
 
     if st.button('Re-train'):
+        from src import train
         with st.spinner('Wait for it...'):
             train.main(
                 data_params,
                 env_params,
                 model_params,
                 train_params,
+                run_params,
                 model_name, 
                 date
             )
@@ -1,5 +1,4 @@
 import base64
-import swifter
 import numpy as np
 import pandas as pd
 import streamlit as st
@@ -78,20 +77,12 @@ def discount_amounts(df, discount_rate, output_seq_len):
         _df = df[df['wrtoff_dt'] == date].reset_index(drop=True)    
         months_in_collection = min(_df.iloc[0, 6], output_seq_len)
         cols = ['actual_recovery_amount_M' + str(i) for i in range(months_in_collection)]
-        _df[cols] = _df[cols].swifter.progress_bar(False).apply(
-            util.discount_series,
-            axis=1,
-            args=(months_in_collection, discount_rate),
-            result_type='expand')
+        _df[cols] = util.discount(_df[cols].to_numpy(dtype=float), discount_rate)
         res_df = pd.concat([res_df, _df])
         
     output_seq_len += 1
     cols = ['predicted_recovery_amount_M' + str(i) for i in range(output_seq_len)]
-    res_df[cols] = res_df[cols].swifter.progress_bar(False).apply(
-        util.discount_series,
-        axis=1,
-        args=(output_seq_len, discount_rate),
-        result_type='expand')
+    res_df[cols] = util.discount(res_df[cols].to_numpy(dtype=float), discount_rate)
     return res_df
 
 
@@ -195,12 +186,7 @@ def plot(df, cumulative, output_seq_len, wrtoff_date):
 def calculate_results(df, output_seq_len):
     res_df = {}
     no_all_accounts = df.shape[0]
-    no_portfolios = 2
     max_RR = 100
-    no_accounts = np.zeros((no_portfolios, max_RR))
-    pred_wrtoffs = np.zeros((no_portfolios, max_RR))
-    predicted_amounts = np.zeros((no_portfolios, max_RR))
-    predicted_rates = np.zeros((no_portfolios, max_RR))
     res_dict = {
         'Predicted recovery rate': [],
         '#Sellable accounts (All%: PL%, Visa%)': [],
@@ -208,39 +194,36 @@ def calculate_results(df, output_seq_len):
         'Predicted recovery amount: PL$, Visa$': [],
     }
 
+    # Sellable accounts of each rate RR: the first m accounts, m being the
+    # smallest number in [2, n] of accounts recovering at least RR% (n if
+    # none), from the running maximum of the cumulative rates
+    recovery = df['marginal_predicted_recovery_amount_M' + str(output_seq_len)].to_numpy(dtype=float)
+    wrtoff = df['wrtoff_amt'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cum_rates = np.cumsum(recovery) / np.cumsum(wrtoff)
+    max_rates = np.maximum.accumulate(np.nan_to_num(cum_rates[1:], nan=-np.inf))
+    targets = np.arange(1, max_RR + 1) / 100
+    cutoffs = np.minimum(np.searchsorted(max_rates, targets) + 2, no_all_accounts)
+
+    # Number, write-off and repayment of each portfolio (PL, Visa) within
+    # the first m accounts, from cumulative sums over the accounts
+    def cumulative(values):
+        return np.concatenate([[0], np.cumsum(values)])[cutoffs]
+    portfolios = [df['product_type'].to_numpy() == product for product in ['PL', 'VS']]
+    no_accounts = np.stack([cumulative(portfolio) for portfolio in portfolios]).astype(float)
+    pred_wrtoffs = np.stack([cumulative(np.where(portfolio, wrtoff, 0)) for portfolio in portfolios])
+    predicted_amounts = np.stack([cumulative(np.where(portfolio, recovery, 0)) for portfolio in portfolios])
+
+    columns = df[[
+        'acct_no', 'acct_id', 'cust_id',
+        'wrtoff_dt', 'wrtoff_amt', 
+        'product_type', 'months_in_collection',
+        # 'predicted_recovery_probability',
+        'predicted_recovery_rate_M' + str(output_seq_len),
+    ]]
+
     for RR in range(1, max_RR + 1):
-        counter, rate = 1, 0
-        while rate < RR / 100:
-            if counter > len(df):
-                break
-            rec = df.loc[:counter, 'marginal_predicted_recovery_amount_M' + str(output_seq_len)].sum(axis=0)
-            wrt = df.loc[:counter, 'wrtoff_amt'].sum(axis=0)
-            rate = rec / wrt
-            counter += 1
-        _df = df.iloc[:counter, :].copy()
-
-        res_df[RR] = _df[[
-            'acct_no', 'acct_id', 'cust_id',
-            'wrtoff_dt', 'wrtoff_amt', 
-            'product_type', 'months_in_collection',
-            # 'predicted_recovery_probability',
-            'predicted_recovery_rate_M' + str(output_seq_len),
-        ]].copy()
-
-        for portfolio in range(no_portfolios):
-            if portfolio == 0:
-                __df = _df[_df['product_type'] == 'PL'].reset_index(drop=True).copy()
-            else:
-                __df = _df[_df['product_type'] == 'VS'].reset_index(drop=True).copy()
-
-            # Number
-            no_accounts[portfolio, RR - 1] = __df.shape[0]
-            # Repayments
-            predicted_amounts[portfolio, RR - 1] = __df['marginal_predicted_recovery_amount_M' + str(output_seq_len)].sum()
-            # Write-off amounts
-            pred_wrtoffs[portfolio, RR - 1] = __df['wrtoff_amt'].sum()
-            # Rate
-            predicted_rates[portfolio, RR - 1] = predicted_amounts[portfolio, RR - 1] / pred_wrtoffs[portfolio, RR - 1]
+        res_df[RR] = columns.iloc[: cutoffs[RR - 1]]
 
         # Add to result dict
         res_dict['Predicted recovery rate'].append('%' + util.human_format(
@@ -263,11 +246,6 @@ def calculate_results(df, output_seq_len):
         )
 
         if int(np.sum(no_accounts, axis=0)[RR - 1] / no_all_accounts) == 1:
-            max_RR = RR
-            no_accounts = no_accounts[:, : max_RR]
-            pred_wrtoffs = pred_wrtoffs[:, : max_RR]
-            predicted_amounts = predicted_amounts[:, : max_RR]
-            predicted_rates = predicted_rates[:, : max_RR]
             break
 
     res_table = pd.DataFrame(data=res_dict)
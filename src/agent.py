@@ -1,36 +1,46 @@
+import importlib
 import numpy as np
-from sb3_contrib import RecurrentPPO
-from stable_baselines3 import PPO
-from stable_baselines3 import A2C
-from stable_baselines3 import DDPG
-from stable_baselines3 import SAC
-from stable_baselines3 import TD3
-from stable_baselines3.common.callbacks import BaseCallback
-from stable_baselines3.common.noise import NormalActionNoise
-from stable_baselines3.common.noise import OrnsteinUhlenbeckActionNoise
+from collections.abc import Mapping
 
+from src.registry import REGISTRY
 
-MODELS = {
-    "a2c": A2C, "ddpg": DDPG, "td3": TD3, "sac": SAC, "ppo": PPO, "lstmppo": RecurrentPPO,
-}
 
-NOISE = {
-    "normal": NormalActionNoise,
-    "ornstein_uhlenbeck": OrnsteinUhlenbeckActionNoise,
-}
+class LazyMapping(Mapping):
+    # name -> "module:attribute", imported on first access so that
+    # stable-baselines3 and torch are only loaded when a model is used
+    def __init__(self, paths):
+        self.paths = paths
+        self._loaded = {}
 
+    def __getitem__(self, key):
+        if key not in self._loaded:
+            module, attribute = self.paths[key].split(":")
+            self._loaded[key] = getattr(importlib.import_module(module), attribute)
+        return self._loaded[key]
 
-class TensorboardCallback(BaseCallback):
-    # Custom callback for plotting additional values in tensorboard.
-    def __init__(self, verbose=0):
-        super().__init__(verbose)
+    def __iter__(self):
+        return iter(self.paths)
 
-    def _on_step(self) -> bool:
-        try:
-            self.logger.record(key="train/reward", value=self.locals["rewards"][0])
-        except BaseException:
-            self.logger.record(key="train/reward", value=self.locals["reward"][0])
-        return True
+    def __len__(self):
+        return len(self.paths)
+
+
+MODELS = LazyMapping({
+    "a2c": "stable_baselines3:A2C",
+    "ddpg": "stable_baselines3:DDPG",
+    "td3": "stable_baselines3:TD3",
+    "sac": "stable_baselines3:SAC",
+    "ppo": "stable_baselines3:PPO",
+    "lstmppo": "sb3_contrib:RecurrentPPO",
+})
+
+# Models whose actions depend on a hidden state, predicted step by step
+RECURRENT = {"lstmppo"}
+
+NOISE = LazyMapping({
+    "normal": "stable_baselines3.common.noise:NormalActionNoise",
+    "ornstein_uhlenbeck": "stable_baselines3.common.noise:OrnsteinUhlenbeckActionNoise",
+})
 
 
 class Agent:
@@ -48,6 +58,8 @@ class Agent:
             and output the trained model
         predict()
             make a prediction in a test dataset and get results
+        predict_batch()
+            predict the whole test dataset with one forward pass
     """
     def __init__(self, env):
         self.env = env
@@ -68,37 +80,58 @@ class Agent:
         )
 
 
-    def train(self, model, train_kwargs=None):            
+    def train(self, model, train_kwargs=None, callbacks=None):            
+        from src.callbacks import TensorboardCallback
         model = model.learn(
-            callback = TensorboardCallback(),
+            callback = [TensorboardCallback()] + (callbacks or []),
             **train_kwargs,
         )
         return model
 
 
     @staticmethod
-    def predict(model_name, environment, cwd, deterministic=True):
+    def predict(model_name, environment, cwd, deterministic=True, batch=True):
         # load agent
         if model_name not in MODELS:
             raise NotImplementedError("NotImplementedError")
         try:
-            model = MODELS[model_name].load(cwd)
+            model = REGISTRY.get(MODELS[model_name], cwd)
         except BaseException:
             raise ValueError("Fail to load agent!")
 
         # make a prediction
+        if batch and model_name not in RECURRENT:
+            return Agent.predict_batch(model, environment, deterministic)
+
         test_env, test_obs = environment.get_sb_env()
         test_env.reset()
 
-        for i in range(len(environment.df.index.unique())):
+        for i in range(environment.n_days):
             action, _states = model.predict(test_obs, deterministic=deterministic)
             test_obs, rewards, done, info = test_env.step(action)
             
-            if i == (len(environment.df.index.unique()) - 2):
+            if i == (environment.n_days - 2):
                 account_memory = test_env.env_method(method_name="save_asset_memory")
                 actions_memory = test_env.env_method(method_name="save_action_memory")
             
             if done[0]:
                 break
 
-        return account_memory[0], actions_memory[0]
+        # the memories are views of the env buffers, which the last step resets
+        return account_memory[0].copy(), actions_memory[0].copy()
+
+
+    @staticmethod
+    def predict_batch(model, environment, deterministic=True):
+        # The observations do not depend on the actions, so the actions of
+        # the whole window come from one forward pass over all of them
+        obs = environment.obs[: environment.n_days - 1].astype(
+            environment.observation_space.dtype
+        )
+        actions, _states = model.predict(obs, deterministic=deterministic)
+
+        # replay the actions to get the portfolio returns and allocations
+        environment.reset()
+        for action in actions:
+            environment.step(action)
+        return environment.save_asset_memory().copy(), environment.save_action_memory().copy()
@@ -0,0 +1,223 @@
+# Walk-forward backtests of a trained model over test windows
+# python -m src.backtest
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from src import params, dataset, model, agent, export
+
+
+LOOKBACK = 252  # days of returns in the covariances when data_params has none
+WARMUP_DAYS = 90  # calendar days of history for the indicators
+
+
+def rolling_windows(start, end, months=1, step=None):
+    """[start, end) windows of `months` months starting every `step` months
+    (default: `months`), the last window ending at or before `end`
+    """
+    length = pd.DateOffset(months=months)
+    step = pd.DateOffset(months=step or months)
+    windows = []
+    cursor = pd.Timestamp(start)
+    while cursor + length <= pd.Timestamp(end):
+        windows.append([
+            cursor.strftime('%Y-%m-%d'), (cursor + length).strftime('%Y-%m-%d')
+        ])
+        cursor += step
+    return windows
+
+
+def simulate(allocations, closes, initial_amount, initial_allocation, commission_perc):
+    """Vectorized StockPortfolioEnv episode for given allocations, without
+    stepping the env
+    :param allocations: (np.ndarray) [... x T-1 x N] allocation held from
+        each day to the next, leading axes for independent episodes
+    :param closes: (np.ndarray) [T x N] close prices
+    :return: (dict) [... x T] series starting with the initial values, like
+        the env memories
+        value: portfolio values after commission
+        daily_return: returns before commission
+        commission: commission fees paid
+    """
+    allocations = np.asarray(allocations, dtype=float)
+    previous = np.concatenate([
+        np.broadcast_to(initial_allocation, allocations[..., :1, :].shape),
+        allocations[..., :-1, :],
+    ], axis=-2)
+    turnover = np.abs(allocations - previous).sum(axis=-1)
+    daily_return = np.sum((closes[1:] / closes[:-1] - 1) * allocations, axis=-1)
+
+    growth = np.cumprod(1 + daily_return - commission_perc / 100 * turnover, axis=-1)
+    value = initial_amount * np.concatenate([np.ones(growth.shape[:-1] + (1,)), growth], axis=-1)
+    commission = commission_perc / 100 * value[..., :-1] * turnover
+
+    def pad(x):
+        return np.concatenate([np.zeros(x.shape[:-1] + (1,)), x], axis=-1)
+    return dict(value=value, daily_return=pad(daily_return), commission=pad(commission))
+
+
+def equal_weight(closes):
+    n_days, n_stocks = closes.shape
+    return np.full((n_days - 1, n_stocks), 1 / n_stocks)
+
+
+def buy_and_hold(closes, initial_allocation):
+    # Weights of the initial holdings drifting with the prices. The env
+    # charges commission on every change of allocation, so this includes
+    # the commission of following the drift.
+    holdings = np.asarray(initial_allocation) / closes[0] * closes[:-1]
+    return holdings / holdings.sum(axis=1, keepdims=True)
+
+
+def min_variance(covs):
+    """Long-only minimum variance allocations
+    :param covs: (np.ndarray) [T x N x N] covariances of each day
+    :return: (np.ndarray) [T-1 x N] closed form weights of the first T-1
+        days, with short positions removed and the rest renormalized
+    """
+    ones = np.ones(covs.shape[-1])
+    weights = np.linalg.pinv(covs[:-1]) @ ones
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = np.clip(weights / weights.sum(axis=1, keepdims=True), 0, None)
+    # days without a long position left (or singular covariances) fall
+    # back to equal weights
+    total = weights.sum(axis=1, keepdims=True)
+    weights = np.where(total > 0, weights, 1.)
+    return weights / np.where(total > 0, total, covs.shape[-1])
+
+
+def baselines(arrays, env_kwargs):
+    # Metrics of the baseline allocations over the days of `arrays`
+    closes = arrays['closes']
+    allocations = dict(
+        equal_weight = equal_weight(closes),
+        buy_and_hold = buy_and_hold(closes, env_kwargs['initial_allocation']),
+        min_variance = min_variance(arrays['covs']),
+    )
+    result = {}
+    for name, allocation in allocations.items():
+        episode = simulate(
+            allocation, closes, env_kwargs['initial_amount'],
+            env_kwargs['initial_allocation'], env_kwargs['commission_perc'],
+        )
+        allocation = np.concatenate([[env_kwargs['initial_allocation']], allocation])
+        result[name] = metrics(episode['value'], allocation)
+    return pd.DataFrame(result).T
+
+
+def metrics(value, allocations):
+    """Performance of one episode
+    :param value: (np.ndarray) [T] portfolio values after commission
+    :param allocations: (np.ndarray) [T x N] allocations
+    :return: (dict) final value, total return, annualized Sharpe ratio,
+        maximum drawdown and mean daily turnover
+    """
+    value = np.asarray(value, dtype=float)
+    returns = value[1:] / value[:-1] - 1
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.
+    return dict(
+        final_value = value[-1],
+        total_return = value[-1] / value[0] - 1,
+        sharpe = np.sqrt(252) * returns.mean() / std if std > 0 else np.nan,
+        max_drawdown = np.max(1 - value / np.maximum.accumulate(value)),
+        turnover = np.abs(np.diff(allocations, axis=0)).sum(axis=1).mean()
+            if len(allocations) > 1 else 0.,
+    )
+
+
+def feature_arrays(data_params, env_kwargs, start, end, lookback):
+    # One download and feature pass from enough history before `start`
+    # to fill the covariances and indicators of the first window, or the
+    # memory-mapped dataset of this range
+    history = pd.Timedelta(days=int(lookback * 1.5) + WARMUP_DAYS)
+    date = [(pd.Timestamp(start) - history).strftime('%Y-%m-%d'), end]
+    return dataset.arrays(data_params, env_kwargs, date, lookback)
+
+
+def window_arrays(arrays, start, end):
+    # Views of the arrays of the days in [start, end)
+    i, j = np.searchsorted(arrays['dates'], [start, end])
+    return dict(
+        dates = arrays['dates'][i:j],
+        tics = arrays['tics'],
+        closes = arrays['closes'][i:j],
+        obs = arrays['obs'][i:j],
+        covs = arrays['covs'][i:j],
+    )
+
+
+def run_window(arrays, env_kwargs, model_name, cwd):
+    env = model.StockPortfolioEnv(df=None, arrays=arrays, **env_kwargs)
+    policy = export.load(cwd) if model_name not in agent.RECURRENT else None
+    if policy is not None:
+        _, df_actions = agent.Agent.predict_batch(policy, env)
+    else:
+        _, df_actions = agent.Agent.predict(model_name, env, cwd)
+
+    allocations = df_actions.values
+    episode = simulate(
+        allocations[1:], env.closes, env.initial_amount, allocations[0], env.commission_perc,
+    )
+    return metrics(episode['value'], allocations)
+
+
+# Shared arrays mapped by a worker process, keyed by block name
+_ATTACHED = {}
+
+
+def _run_shared_window(spec, window, env_kwargs, model_name, cwd):
+    key = spec['path'] if 'path' in spec else spec['obs'][0]
+    if key not in _ATTACHED:
+        _ATTACHED[key] = model.attach_arrays(spec)
+    return run_window(window_arrays(_ATTACHED[key], *window), env_kwargs, model_name, cwd)
+
+
+def main(data_params, env_kwargs, model_name, windows=None, lookback=None, max_workers=1):
+    """Backtests a model over test windows
+    :param windows: (list) [start, end) dates, default data_params['test_dates']
+    :param lookback: (int) days of returns in the covariances
+    :param max_workers: (int) number of processes running windows
+    :return: (df) one row of metrics per window with at least 2 days
+    """
+    windows = windows or data_params['test_dates']
+    lookback = lookback or data_params['lookback'] or LOOKBACK
+    cwd = os.path.join('src', model_name)
+
+    arrays = feature_arrays(
+        data_params, env_kwargs,
+        min(w[0] for w in windows), max(w[1] for w in windows), lookback,
+    )
+    windows = [w for w in windows if len(window_arrays(arrays, *w)['dates']) > 1]
+
+    if max_workers > 1:
+        # workers map the arrays instead of receiving a copy per window
+        shared = model.SharedArrays(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers) as executor:
+                results = list(executor.map(
+                    _run_shared_window,
+                    [shared.spec] * len(windows),
+                    windows,
+                    [env_kwargs] * len(windows),
+                    [model_name] * len(windows),
+                    [cwd] * len(windows),
+                ))
+        finally:
+            shared.close()
+    else:
+        results = [
+            run_window(window_arrays(arrays, *w), env_kwargs, model_name, cwd)
+            for w in windows
+        ]
+
+    return pd.DataFrame([
+        dict(start=w[0], end=w[1], days=len(window_arrays(arrays, *w)['dates']), **result)
+        for w, result in zip(windows, results)
+    ])
+
+
+if __name__ == '__main__':
+    data_params, env_params, _, _, _, model_name = params.main()
+    print(main(data_params, env_params, model_name).to_string())
@@ -0,0 +1,124 @@
+# Offline throughput benchmarks of the feature/env/agent pipeline
+# python -m src.benchmark
+
+import os
+import time
+import numpy as np
+import pandas as pd
+
+from src import params, data, model, agent
+
+
+def timeit(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def env_steps(env, n_steps=10000, seed=42):
+    # Steps per second of a single environment with random actions
+    rng = np.random.default_rng(seed)
+    actions = rng.uniform(0, 1, (n_steps, env.action_space.shape[0]))
+    env.reset()
+    start = time.perf_counter()
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+    return n_steps / (time.perf_counter() - start)
+
+
+def vec_env_steps(vec_env, n_steps=2000, seed=42):
+    # Steps per second summed over the copies of a vectorized environment
+    rng = np.random.default_rng(seed)
+    actions = rng.uniform(0, 1, (n_steps, vec_env.num_envs) + vec_env.action_space.shape)
+    vec_env.reset()
+    start = time.perf_counter()
+    for action in actions:
+        vec_env.step(action)
+    return n_steps * vec_env.num_envs / (time.perf_counter() - start)
+
+
+def subproc_scaling(max_workers=None, date=('2018-01-01', '2023-01-01'), lookback=252):
+    # Steps per second of SubprocVecEnv with 1 ... max_workers worker processes
+    data_params, env_params, _, _, _, _ = params.main()
+    df, features = data.main(
+        stocks = data_params['stocks'],
+        date = list(date),
+        source = 'synthetic',
+        lookback = lookback,
+    )
+    env = model.StockPortfolioEnv(df=df, covs=features['covs'], **env_params)
+
+    result = {}
+    for n_workers in range(1, (max_workers or os.cpu_count()) + 1):
+        vec_env, _ = env.get_sb_subproc_env(n_workers)
+        try:
+            result[n_workers] = vec_env_steps(vec_env)
+        finally:
+            vec_env.close()
+            env.shared_arrays.close()
+    return result
+
+
+def turbulence(n_tics=100, date=('2013-01-01', '2023-01-01')):
+    # Seconds of the batched and the per-date turbulence index of a
+    # synthetic universe, and the largest difference between them
+    from src import preprocessor, sources
+
+    source = sources.SyntheticSource()
+    df = pd.concat([
+        source.download(f'T{i:03d}', *date).reset_index().assign(tic=f'T{i:03d}')
+        for i in range(n_tics)
+    ])
+    df = df.rename(columns={'Date': 'date', 'Close': 'close'})[['date', 'tic', 'close']]
+    df['date'] = df.date.dt.strftime('%Y-%m-%d')
+
+    fe = preprocessor.FeatureEngineer()
+    batched, t_batched = timeit(fe.calculate_turbulence, df)
+    loop, t_loop = timeit(fe.calculate_turbulence_loop, df)
+    return dict(
+        batched_sec = t_batched,
+        loop_sec = t_loop,
+        max_rel_diff = np.max(np.abs(batched.turbulence - loop.turbulence) / np.maximum(loop.turbulence, 1)),
+    )
+
+
+def pipeline(date=('2018-01-01', '2023-01-01'), source='synthetic', source_kwargs=None):
+    data_params, env_params, _, _, _, model_name = params.main()
+
+    (df, features), t_data = timeit(
+        data.main,
+        stocks = data_params['stocks'],
+        date = list(date),
+        source = source,
+        source_kwargs = source_kwargs or {},
+    )
+    env, t_env = timeit(model.StockPortfolioEnv, df=df, covs=features['covs'], **env_params)
+    steps_per_sec = env_steps(env)
+    _, t_predict = timeit(
+        agent.Agent.predict,
+        model_name = model_name,
+        environment = env,
+        cwd = os.path.join('src', model_name),
+    )
+
+    return dict(
+        data_sec = t_data,
+        env_init_sec = t_env,
+        env_steps_per_sec = steps_per_sec,
+        predict_sec = t_predict,
+    )
+
+
+if __name__ == '__main__':
+    for key, value in pipeline().items():
+        print(f'{key:>20}: {value:.4f}')
+
+    print('Turbulence index, 100 tickers')
+    for key, value in turbulence().items():
+        print(f'{key:>20}: {value:.4g}')
+
+    print('SubprocVecEnv workers: steps/sec')
+    for n_workers, steps_per_sec in subproc_scaling().items():
+        print(f'{n_workers:>20}: {steps_per_sec:.1f}')
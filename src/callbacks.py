@@ -0,0 +1,197 @@
+import os
+import time
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+
+
+def rss():
+    # Resident memory of this process in bytes
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        # no /proc on macOS and Windows
+        return np.nan
+
+
+class TensorboardCallback(BaseCallback):
+    """Custom callback for plotting additional values in tensorboard
+    Notes
+    -----
+        train/reward is the mean reward of the envs at each step. The perf/
+        values are recorded at the end of every rollout:
+        steps_per_sec: env steps per second since the start of training
+        rollout_sec, train_sec: time spent collecting rollouts and in
+            gradient updates (up to the previous rollout) since the start,
+            recorded once more at the end of training with the last update
+        step_latency_p50/p90/p99_ms: percentiles of the time between steps
+            of the rollout (env step and policy forward pass)
+        rss_mb: resident memory of the process
+    """
+    def __init__(self, verbose=0):
+        super().__init__(verbose)
+        self._rollout_sec = 0.
+        self._train_sec = 0.
+        self._rollout_end = None
+        self._latencies = []
+
+    def _on_training_start(self) -> None:
+        self._start = time.perf_counter()
+        self._start_timesteps = self.num_timesteps
+
+    def _on_rollout_start(self) -> None:
+        now = time.perf_counter()
+        # the gradient updates run between two rollouts
+        if self._rollout_end is not None:
+            self._train_sec += now - self._rollout_end
+        self._rollout_end = None
+        self._rollout_start = self._last_step = now
+        self._latencies = []
+
+    def _on_step(self) -> bool:
+        now = time.perf_counter()
+        self._latencies.append(now - self._last_step)
+        self._last_step = now
+        self.logger.record(key="train/reward", value=float(np.mean(self.locals["rewards"])))
+        return True
+
+    def _on_rollout_end(self) -> None:
+        now = time.perf_counter()
+        self._rollout_sec += now - self._rollout_start
+        self._rollout_end = now
+
+        self.logger.record(
+            key="perf/steps_per_sec",
+            value=(self.num_timesteps - self._start_timesteps) / (now - self._start),
+        )
+        self.logger.record(key="perf/rollout_sec", value=self._rollout_sec)
+        self.logger.record(key="perf/train_sec", value=self._train_sec)
+        if self._latencies:
+            for q, latency in zip((50, 90, 99), np.percentile(self._latencies, (50, 90, 99))):
+                self.logger.record(key=f"perf/step_latency_p{q}_ms", value=latency * 1000)
+        self.logger.record(key="perf/rss_mb", value=rss() / 2 ** 20)
+
+    def _on_training_end(self) -> None:
+        # the update after the last rollout, unless training stopped within it
+        if self._rollout_end is None:
+            return
+        self._train_sec += time.perf_counter() - self._rollout_end
+        self._rollout_end = None
+        self.logger.record(key="perf/rollout_sec", value=self._rollout_sec)
+        self.logger.record(key="perf/train_sec", value=self._train_sec)
+        self.logger.dump(self.num_timesteps)
+
+
+class EarlyStoppingCallback(BaseCallback):
+    """Stops training when the mean reward falls behind a reference curve
+    Attributes
+    ----------
+        check_freq: int
+            timesteps (summed over the envs) between checks, so that runs
+            with different n_steps or n_envs check at the same timesteps
+        reference: list
+            mean reward to reach at each check, e.g. the median of other
+            trials, no stopping if None or after its end
+        history: list
+            mean reward of every check so far, the i-th at
+            (i + 1) * check_freq timesteps
+        stopped: bool
+            whether training was stopped early
+    """
+    def __init__(self, check_freq, reference=None, verbose=0):
+        super().__init__(verbose)
+        self.check_freq = check_freq
+        self.reference = reference or []
+        self.history = []
+        self.stopped = False
+        self._reward_sum = 0.
+        self._reward_count = 0
+
+    def _on_step(self) -> bool:
+        rewards = self.locals["rewards"]
+        self._reward_sum += float(rewards.sum())
+        self._reward_count += len(rewards)
+        n_checks = self.num_timesteps // self.check_freq
+        if n_checks <= len(self.history):
+            return True
+
+        mean_reward = self._reward_sum / self._reward_count
+        self._reward_sum, self._reward_count = 0., 0
+        # a step of many envs may pass several checks at once
+        self.history.extend([mean_reward] * (n_checks - len(self.history)))
+
+        check = len(self.history) - 1
+        if check < len(self.reference) and mean_reward < self.reference[check]:
+            self.stopped = True
+        return not self.stopped
+
+
+def save_atomic(model, path):
+    # Writes `<path>.zip` through a temporary file, so that an interrupted
+    # save never leaves a truncated archive
+    model.save(path + ".tmp")
+    os.replace(path + ".tmp", path + ".zip")
+
+
+def checkpoints(checkpoint_dir, prefix):
+    """Checkpoints of a training job, oldest first
+    :return: (list) (timesteps, path without extension)
+    """
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    found = []
+    for name in os.listdir(checkpoint_dir):
+        stem, ext = os.path.splitext(name)
+        steps = stem[len(prefix) + 1 : -len("_steps")]
+        if ext == ".zip" and stem.startswith(prefix + "_") and stem.endswith("_steps") and steps.isdigit():
+            found.append((int(steps), os.path.join(checkpoint_dir, stem)))
+    return sorted(found)
+
+
+def remove_checkpoints(checkpoint_dir, prefix, keep=0):
+    # Removes all but the last `keep` checkpoints
+    found = checkpoints(checkpoint_dir, prefix)
+    for _, path in found[: max(len(found) - keep, 0)]:
+        if os.path.exists(path + ".zip"):
+            os.remove(path + ".zip")
+
+
+class CheckpointCallback(BaseCallback):
+    """Saves the model (with its optimizer state) every `save_freq`
+    timesteps
+    Attributes
+    ----------
+        save_freq: int
+            timesteps between checkpoints, over all envs, saved at the
+            multiples of save_freq also after resuming
+        checkpoint_dir: str
+            directory of the `<prefix>_<timesteps>_steps.zip` files
+        prefix: str
+            name of the training job
+        keep: int
+            number of most recent checkpoints kept
+    """
+    def __init__(self, save_freq, checkpoint_dir, prefix, keep=3, verbose=0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.checkpoint_dir = checkpoint_dir
+        self.prefix = prefix
+        self.keep = keep
+        self._last_save = 0
+
+    def _init_callback(self) -> None:
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def _on_training_start(self) -> None:
+        # self.num_timesteps is only synced with the model from the first step
+        self._last_save = self.model.num_timesteps
+
+    def _on_step(self) -> bool:
+        if self.num_timesteps // self.save_freq <= self._last_save // self.save_freq:
+            return True
+        self._last_save = self.num_timesteps
+
+        path = os.path.join(self.checkpoint_dir, f"{self.prefix}_{self.num_timesteps}_steps")
+        save_atomic(self.model, path)
+        remove_checkpoints(self.checkpoint_dir, self.prefix, self.keep)
+        return True
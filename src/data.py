@@ -1,58 +1,188 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-from src import downloader, preprocessor
 
+def main(
+    stocks,
+    date=None,
+    cache_dir=None,
+    source='yahoo',
+    source_kwargs=None,
+    max_workers=8,
+    incremental_indicators=False,
+    lookback=None,
+    warmup_years=None,
+):
+    """Prices and features of the stocks between two dates, the same with
+    or without a cache_dir
+    :param cache_dir: (str) directory of the price and feature stores (None:
+        download and engineer every time)
+    :param incremental_indicators: (bool) compute the indicators bar by bar
+        with an indicator state, continued by the calls with the same
+        origin
+    :param lookback: (int) days of returns in the covariances (None: all
+        days of the range but the last)
+    :param warmup_years: (int) the indicators start at the beginning of
+        the year `warmup_years` years before the start year (None: at the
+        start date)
+    :return: (df, dict) rows per (date, tic) and the arrays of each date
+        dates: [T] dates of the rows
+        covs: [T x N x N] float32 covariances of the returns
+        returns: [T x L x N] float32 returns of the look back of each date,
+            a view of daily_returns
+        daily_returns: [T + L - 1 x N] float32 returns of the windows
+    """
+    # yfinance and stockstats are only imported when data is fetched
+    from src import preprocessor
+
+    indicator_date = [indicator_origin(date[0], warmup_years), date[1]]
+    if cache_dir is None:
+        rows, _ = add_indicators(
+            fetch(stocks, indicator_date, cache_dir, source, source_kwargs, max_workers),
+            incremental_indicators,
+        )
+    else:
+        rows = stored_rows(
+            stocks, indicator_date, cache_dir, source, source_kwargs, max_workers,
+            incremental_indicators,
+        )
+
+    return add_covariances(preprocessor.data_split(rows, date[0], date[1]), lookback)
+
+
+def indicator_origin(start, warmup_years=None):
+    # First date of the indicators of a range starting at `start`: with a
+    # warm up, the ranges starting within a year share their origin (and
+    # their stored rows)
+    if warmup_years is None:
+        return start
+    return f'{int(start[:4]) - warmup_years}-01-01'
+
+
+def stored_rows(stocks, date, cache_dir, source, source_kwargs, max_workers,
+                incremental_indicators):
+    """Rows with indicators of a date range, read from the FeatureStore of
+    cache_dir, the same as those computed without it
+    :param date: ([str, str]) [origin, end) dates, the indicators start at
+        the origin
+    :return: (df) rows per (date, tic)
+    Notes
+    -----
+        An entry of the same origin ending before `end` is extended with
+        the missing dates from its indicator state if the indicators are
+        incremental, which gives the values of computing them all again,
+        and computed again otherwise.
+    """
+    from src import preprocessor, store
+
+    features = store.FeatureStore(cache_dir)
+    key = features.key(
+        stocks = sorted(stocks),
+        indicators = preprocessor.INDICATORS,
+        source = source,
+        source_kwargs = source_kwargs or {},
+        origin = date[0],
+        incremental_indicators = incremental_indicators,
+    )
+    cached = features.read(key)
+    if cached is not None and cached['end'] >= date[1]:
+        return cached['df']
+
+    rows, state = None, None
+    if cached is not None and cached['state'] is not None:
+        # recompute the last stored date, its bar may have been incomplete
+        last_date = cached['df'].date.iat[-1]
+        tail = fetch(stocks, [last_date, date[1]], cache_dir, source, source_kwargs, max_workers)
+        if set(tail.tic) == set(cached['df'].tic):
+            tail, state = add_indicators(tail, True, cached['state'])
+        # the stored state is continued unless the stored bars have changed
+        if state is cached['state']:
+            rows = pd.concat([cached['df'][cached['df'].date < last_date], tail], ignore_index=True)
+
+    if rows is None:
+        rows, state = add_indicators(
+            fetch(stocks, date, cache_dir, source, source_kwargs, max_workers),
+            incremental_indicators,
+        )
+
+    features.write(key, rows, state, date[1])
+    return rows
+
+
+def fetch(stocks, date, cache_dir, source, source_kwargs, max_workers):
+    from src import downloader, sources
 
-def main(stocks, date=None):
     df = downloader.YahooDownloader(
         start_date = date[0],
         end_date = date[1],
         ticker_list = stocks,
+        cache_dir = cache_dir,
+        source = sources.SOURCES[source](**(source_kwargs or {})),
+        max_workers = max_workers,
     ).fetch_data()
-    
+
     st.write('Data')
     st.write(df.tail(4))
-    
+    return df
+
+
+def add_indicators(df, incremental_indicators, state=None):
+    """Adds the indicators to downloaded prices
+    :param df: (df) prices from the downloader
+    :param state: (IndicatorState) indicator state of the dates before,
+        ending with the first date of `df`, to compute only the dates of `df`
+    :return: (df, IndicatorState) rows with indicators and the indicator
+        state after the last date (None if not incremental or if the rows
+        of some tickers are missing)
+    """
+    from src import preprocessor
+
     fe = preprocessor.FeatureEngineer(
         use_technical_indicator = True,
         use_turbulence = False,
         user_defined_feature = False,
+        incremental = incremental_indicators,
+        indicator_state = state,
     )
-
     df = fe.preprocess_data(df)
 
-    # Add covariance matrix as states
+    # missing rows are handled by stockstats, which has no state
+    if not incremental_indicators or len(df) != df.date.nunique() * df.tic.nunique():
+        return df, None
+    return df, fe.indicator_state
+
+
+def add_covariances(df, lookback):
+    """Adds the covariance states to rows with indicators
+    :param df: (df) rows of a date range
+    :param lookback: (int) days of returns in the covariances (None: all
+        days but the last)
+    :return: (df, dict) rows of the dates with a full look back and their
+        arrays (see main())
+    """
+    from src import preprocessor
+
     df = df.sort_values(['date', 'tic'], ignore_index=True)
     df.index = df.date.factorize()[0]
 
-    cov_list = []
-    return_list = []
+    # Look back defaults to the whole window but the last day
+    if lookback is None:
+        lookback = len(df.index.unique()) - 2
 
-    # Look back is one year
-    lookback = len(df.index.unique()) - 2
-
-    for i in range(lookback, len(df.index.unique())):
-        data_lookback = df.loc[i - lookback : i, :]
-        price_lookback = data_lookback.pivot_table(
-            index='date', columns='tic', values='close'
-        )
-        return_lookback = price_lookback.pct_change().dropna()
-        return_list.append(return_lookback)
-
-        covs = return_lookback.cov().values
-        cov_list.append(covs)
-
-    df_cov = pd.DataFrame(
-        {
-            'date': df.date.unique()[lookback:],
-            'cov_list': cov_list,
-            'return_list': return_list,
-        }
+    # Covariances and return windows are arrays indexed by date instead of
+    # objects on every row, the windows are views of the daily returns
+    price = df.pivot_table(index='date', columns='tic', values='close')
+    returns = price.pct_change().values
+    daily_returns = returns[1:].astype(np.float32)
+    arrays = dict(
+        dates = price.index[lookback:].values,
+        covs = preprocessor.rolling_covariance(returns, lookback).astype(np.float32),
+        daily_returns = daily_returns,
+        returns = preprocessor.return_windows(daily_returns, lookback),
     )
 
-    df = df.merge(df_cov, on='date')
+    df = df[df.date.isin(arrays['dates'])]
     df = df.sort_values(['date', 'tic']).reset_index(drop=True)
-    df = preprocessor.data_split(df, date[0], date[1])
-
-    return df
+    df.index = df.date.factorize()[0]
+    return df, arrays
@@ -0,0 +1,167 @@
+# Memory-mapped datasets of StockPortfolioEnv, written once by the data
+# pipeline and opened by any number of training or backtest processes,
+# which then share the pages of the files instead of each engineering and
+# holding the features
+# python -m src.dataset start end
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import datetime
+import numpy as np
+
+
+VERSION = 1
+
+# Arrays of a dataset, one .npy file each
+ARRAYS = dict(
+    closes = np.float64,  # [T x N] close prices
+    obs = np.float32,  # [T x (N + K) x N] covariances over indicators
+    daily_returns = np.float32,  # [T + L - 1 x N] returns of the covariance windows
+)
+
+
+def key(**inputs):
+    inputs = dict(inputs, version=VERSION)
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def write(path, arrays, lookback, tech_indicator_list):
+    """Writes the arrays of market_arrays() and data.main() to a directory
+    :param path: (str) dataset directory, replaced if it exists
+    :param arrays: (dict) dates, tics, closes, obs and daily_returns
+    :param lookback: (int) number of returns of a covariance window
+    :return: (str) path
+    """
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    manifest = dict(
+        version = VERSION,
+        dates = [str(d) for d in arrays['dates']],
+        tics = [str(t) for t in arrays['tics']],
+        tech_indicator_list = list(tech_indicator_list),
+        lookback = int(lookback),
+        arrays = {},
+    )
+    for name, dtype in ARRAYS.items():
+        array = np.ascontiguousarray(arrays[name], dtype=dtype)
+        np.save(os.path.join(tmp, name + '.npy'), array)
+        manifest['arrays'][name] = dict(shape=list(array.shape), dtype=array.dtype.str)
+
+    # the manifest is written last, a directory without one is incomplete
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return path
+
+
+def read(path):
+    """Maps a dataset written by write()
+    :return: (dict) arrays of StockPortfolioEnv(arrays=...), read-only
+        memory maps, with the covariances and return windows as views and
+        the path of the dataset, None if there is no complete dataset at
+        path
+    """
+    from src import preprocessor
+
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest['version'] != VERSION:
+        return None
+
+    arrays = dict(
+        path = path,
+        dates = np.array(manifest['dates'], dtype=object),
+        tics = np.array(manifest['tics'], dtype=object),
+    )
+    for name in ARRAYS:
+        arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        if list(arrays[name].shape) != manifest['arrays'][name]['shape']:
+            raise ValueError(f"{name}.npy of {path} does not match its manifest.")
+
+    arrays['covs'] = arrays['obs'][:, : len(arrays['tics'])]
+    arrays['returns'] = preprocessor.return_windows(arrays['daily_returns'], manifest['lookback'])
+    return arrays
+
+
+def arrays(data_params, env_kwargs, date, lookback=None):
+    """Arrays of StockPortfolioEnv(arrays=...) of a date range, mapped from
+    data_params['dataset_dir'] if it is set, else engineered in memory
+    :param date: ([str, str]) [start, end) dates
+    :param lookback: (int) days of returns in the covariances (None:
+        data_params['lookback'])
+    :return: (dict) see read() and build()
+    """
+    if data_params.get('dataset_dir'):
+        return load(data_params, env_kwargs, date, lookback)
+    return build(data_params, env_kwargs, date, lookback)
+
+
+def build(data_params, env_kwargs, date, lookback=None):
+    """Engineers the arrays of a date range with data.main()
+    :return: (dict) arrays of data.main() and model.market_arrays()
+    """
+    from src import data, model
+
+    df, features = data.main(
+        stocks = data_params['stocks'],
+        date = list(date),
+        cache_dir = data_params['cache_dir'],
+        source = data_params['source'],
+        source_kwargs = data_params['source_kwargs'],
+        max_workers = data_params['max_workers'],
+        incremental_indicators = data_params['incremental_indicators'],
+        lookback = lookback or data_params['lookback'],
+        warmup_years = data_params['warmup_years'],
+    )
+    return dict(features, **model.market_arrays(
+        df, env_kwargs['stock_dim'], env_kwargs['tech_indicator_list'], features['covs']))
+
+
+def load(data_params, env_kwargs, date, lookback=None):
+    """Maps the dataset of a date range, building it with data.main() if
+    it is not in data_params['dataset_dir'] yet
+    :param date: ([str, str]) [start, end) dates
+    :param lookback: (int) days of returns in the covariances (None:
+        data_params['lookback'])
+    :return: (dict) arrays of StockPortfolioEnv(arrays=...), see read()
+    """
+    lookback = lookback or data_params['lookback']
+    # every data_params value that data.main() reads
+    path = os.path.join(data_params['dataset_dir'], key(
+        stocks = sorted(data_params['stocks']),
+        date = list(date),
+        lookback = lookback,
+        source = data_params['source'],
+        source_kwargs = data_params['source_kwargs'],
+        cache_dir = data_params['cache_dir'],
+        incremental_indicators = data_params['incremental_indicators'],
+        warmup_years = data_params['warmup_years'],
+        tech_indicator_list = list(env_kwargs['tech_indicator_list']),
+    ))
+    dataset = read(path)
+    if dataset is not None:
+        return dataset
+
+    built = build(data_params, env_kwargs, date, lookback)
+
+    # a range reaching today may still get prices, it is not written
+    if date[1] > datetime.date.today().strftime('%Y-%m-%d'):
+        return built
+    write(path, built, built['returns'].shape[1], env_kwargs['tech_indicator_list'])
+    return read(path)
+
+
+if __name__ == '__main__':
+    from src import params
+    data_params, env_params, _, _, _, _ = params.main()
+    print(load(data_params, env_params, sys.argv[1:3])['path'])
@@ -1,38 +1,64 @@
+import time
 import pandas as pd
-import yfinance as yf
+from concurrent.futures import ThreadPoolExecutor
+
+from src import sources, store
 
 
 class YahooDownloader:
     # Provides methods for retrieving daily stock data from
-    def __init__(self, start_date: str, end_date: str, ticker_list: list):
+    def __init__(
+        self,
+        start_date: str,
+        end_date: str,
+        ticker_list: list,
+        cache_dir=None,
+        source=None,
+        max_workers=8,
+        retries=3,
+        backoff=1.,
+    ):
         self.start_date = start_date
         self.end_date = end_date
         self.ticker_list = ticker_list
+        # number of tickers downloaded concurrently (1 for serial downloads)
+        self.max_workers = max_workers
+        # attempts per ticker after a failed request, waiting backoff * 2 ** attempt
+        self.retries = retries
+        self.backoff = backoff
+        # per-ticker timings and failures of the last fetch_data call
+        self.report = None
+        # price source (see `sources.SOURCES`), Yahoo by default
+        self.source = source if source is not None else sources.YahooSource()
+        # consult the local price store before downloading if given
+        self.store = None
+        if cache_dir is not None and self.source.cacheable:
+            self.store = store.PriceStore(cache_dir)
 
 
     def fetch_data(self, proxy=None) -> pd.DataFrame:
-        """Fetches data from Yahoo API
+        """Fetches data from the price source (Yahoo API by default)
         Returns
         -------
         `pd.DataFrame`
             7 columns: A date, open, high, low, close, volume and tick symbol
             for the specified stock ticker
         """
-        # Download and save the data in a pandas DataFrame:
-        data_df = pd.DataFrame()
-        num_failures = 0
-        for tic in self.ticker_list:
-            temp_df = yf.download(
-                tic, start=self.start_date, end=self.end_date, proxy=proxy
-            )
-            temp_df["tic"] = tic
-            if len(temp_df) > 0:
-                # data_df = data_df.append(temp_df)
-                data_df = pd.concat([data_df, temp_df], axis=0)
-            else:
-                num_failures += 1
-        if num_failures == len(self.ticker_list):
+        # Download the tickers concurrently and save the data in a pandas DataFrame:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(
+                lambda tic: self._download_with_retry(tic, proxy), self.ticker_list
+            ))
+        self.report = pd.DataFrame(
+            [report for _, report in results],
+            columns=["tic", "seconds", "rows", "attempts", "error"],
+        ).sort_values("seconds", ascending=False, ignore_index=True)
+        print("Download report:\n", self.report.to_string(index=False))
+
+        temp_dfs = [temp_df for temp_df, _ in results if len(temp_df) > 0]
+        if len(temp_dfs) == 0:
             raise ValueError("no data is fetched.")
+        data_df = pd.concat(temp_dfs, axis=0)
         # reset the index, we want to use numbers as index instead of dates
         data_df = data_df.reset_index()
         try:
@@ -68,6 +94,41 @@ class YahooDownloader:
         return data_df
 
 
+    def _download_with_retry(self, tic, proxy=None):
+        start = time.perf_counter()
+        temp_df, error = pd.DataFrame(), None
+        for attempt in range(1, self.retries + 2):
+            try:
+                temp_df = self.download(tic, proxy=proxy)
+                error = None
+                break
+            except Exception as e:
+                error = repr(e)
+                if attempt <= self.retries:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+        temp_df["tic"] = tic
+        report = (tic, time.perf_counter() - start, len(temp_df), attempt, error)
+        return temp_df, report
+
+
+    def download(self, tic, proxy=None) -> pd.DataFrame:
+        """Downloads a single ticker, only fetching the date ranges
+        missing from the local price store when one is configured
+        """
+        if self.store is None:
+            return self.source.download(
+                tic, self.start_date, self.end_date, proxy=proxy
+            )
+        for start_date, end_date in self.store.missing_ranges(
+            tic, self.start_date, self.end_date
+        ):
+            temp_df = self.source.download(
+                tic, start_date, end_date, proxy=proxy
+            )
+            self.store.write(tic, temp_df, start_date, end_date)
+        return self.store.read(tic, self.start_date, self.end_date)
+
+
     def select_equal_rows_stock(self, df):
         df_check = df.tic.value_counts()
         df_check = pd.DataFrame(df_check).reset_index()
@@ -0,0 +1,158 @@
+# Exports a trained MLP policy to NumPy arrays for inference without
+# stable-baselines3 and torch
+# python -m src.export [model_name]
+
+import os
+import sys
+import hashlib
+import numpy as np
+
+
+TOL = 1e-5  # largest action difference of an exported policy
+
+ACTIVATIONS = {
+    "Tanh": np.tanh,
+    "ReLU": lambda x: np.maximum(x, 0),
+}
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def export_policy(model, path):
+    """Writes the actor of a model with a flattened Box observation and a
+    Gaussian Box action to `<path>.npz`
+    :param model: (BaseAlgorithm) model saved at `<path>.zip`
+    :param path: (str) archive path without the .zip extension
+    :return: (str) path of the written weights file
+    """
+    from torch import nn
+    from stable_baselines3.common.distributions import DiagGaussianDistribution
+    from stable_baselines3.common.torch_layers import FlattenExtractor
+
+    policy = model.policy
+    if (
+        not isinstance(policy.action_dist, DiagGaussianDistribution)
+        or not isinstance(policy.pi_features_extractor, FlattenExtractor)
+        or policy.squash_output
+    ):
+        raise NotImplementedError("only MLP policies with Gaussian actions can be exported")
+
+    layers = [m for m in policy.mlp_extractor.policy_net if isinstance(m, nn.Linear)]
+    activations = {type(m).__name__ for m in policy.mlp_extractor.policy_net} - {"Linear"}
+    if len(activations) > 1 or not activations <= set(ACTIVATIONS):
+        raise NotImplementedError(f"unsupported activation {activations}")
+
+    arrays = {}
+    for i, layer in enumerate(layers + [policy.action_net]):
+        arrays[f"weight_{i}"] = layer.weight.detach().cpu().numpy()
+        arrays[f"bias_{i}"] = layer.bias.detach().cpu().numpy()
+
+    np.savez(
+        path + ".npz",
+        n_layers = len(layers) + 1,
+        activation = activations.pop() if activations else "Tanh",
+        log_std = policy.log_std.detach().cpu().numpy(),
+        observation_shape = np.array(model.observation_space.shape),
+        action_low = model.action_space.low,
+        action_high = model.action_space.high,
+        model_hash = file_hash(path + ".zip"),
+        **arrays,
+    )
+    return path + ".npz"
+
+
+class NumpyPolicy:
+    """Forward pass of an exported policy with NumPy
+    Attributes
+    ----------
+        weights: list
+            (weight, bias) of the hidden layers and the action layer
+        activation: function
+            activation of the hidden layers
+        model_hash: str
+            SHA-256 of the model archive the policy was exported from
+    Methods
+    -------
+        predict()
+            return the actions of observations like model.predict()
+    """
+    def __init__(self, path):
+        with np.load(path) as f:
+            self.weights = [
+                (f[f"weight_{i}"], f[f"bias_{i}"]) for i in range(int(f["n_layers"]))
+            ]
+            self.activation = ACTIVATIONS[str(f["activation"])]
+            self.std = np.exp(f["log_std"])
+            self.observation_shape = tuple(f["observation_shape"])
+            self.action_low = f["action_low"]
+            self.action_high = f["action_high"]
+            self.model_hash = str(f["model_hash"])
+
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True, rng=None):
+        obs = np.asarray(observation, dtype=np.float32)
+        vectorized = obs.shape != self.observation_shape
+        x = obs.reshape(-1, int(np.prod(self.observation_shape)))
+
+        for weight, bias in self.weights[:-1]:
+            x = self.activation(x @ weight.T + bias)
+        weight, bias = self.weights[-1]
+        actions = x @ weight.T + bias
+        if not deterministic:
+            rng = rng or np.random.default_rng()
+            actions = actions + self.std * rng.standard_normal(actions.shape).astype(np.float32)
+
+        actions = np.clip(actions, self.action_low, self.action_high)
+        return (actions if vectorized else actions[0]), None
+
+
+def load(path):
+    """Returns the exported policy of the model at `<path>.zip`, or None if
+    it was not exported or the model has changed since
+    """
+    if not os.path.exists(path + ".npz") or not os.path.exists(path + ".zip"):
+        return None
+    policy = NumpyPolicy(path + ".npz")
+    if policy.model_hash != file_hash(path + ".zip"):
+        return None
+    return policy
+
+
+def parity(model, policy, n_obs=1000, seed=42):
+    # Largest difference between the deterministic actions of the model
+    # and of its exported policy on random observations
+    rng = np.random.default_rng(seed)
+    obs = rng.normal(size=(n_obs,) + policy.observation_shape).astype(np.float32)
+    expected, _ = model.predict(obs, deterministic=True)
+    actions, _ = policy.predict(obs, deterministic=True)
+    return np.abs(expected - actions).max()
+
+
+def export_checked(model, path, tol=TOL):
+    """Exports the policy of a model like export_policy() and removes the
+    weights file again if its actions differ from those of the model
+    :return: (float) largest action difference on random observations
+    """
+    out = export_policy(model, path)
+    diff = parity(model, NumpyPolicy(out))
+    if diff > tol:
+        os.remove(out)
+    return diff
+
+
+def main(model_name, tol=TOL):
+    from stable_baselines3 import PPO
+
+    path = os.path.join('src', model_name)
+    diff = export_checked(PPO.load(path), path, tol)
+    if diff > tol:
+        raise ValueError(f"exported policy differs from the model by {diff}")
+    print(f'{path}.npz: max action difference {diff:.2e}')
+
+
+if __name__ == '__main__':
+    from src import params
+    main(sys.argv[1] if len(sys.argv) > 1 else params.main()[-1])
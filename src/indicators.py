@@ -0,0 +1,285 @@
+import re
+import numpy as np
+import pandas as pd
+
+
+# Indicator names computed here, following the stockstats definitions
+PATTERNS = {
+    "macd": re.compile(r"^macd$"),
+    "boll": re.compile(r"^boll_(ub|lb)$"),
+    "rsi": re.compile(r"^rsi_(\d+)$"),
+    "cci": re.compile(r"^cci_(\d+)$"),
+    "dx": re.compile(r"^dx_(\d+)$"),
+    "sma": re.compile(r"^close_(\d+)_sma$"),
+}
+
+MACD_EMA_SHORT = 12
+MACD_EMA_LONG = 26
+BOLL_PERIOD = 20
+BOLL_STD_TIMES = 2
+
+
+def parse(indicator):
+    # Returns (kind, window) of a supported indicator name, None otherwise
+    for kind, pattern in PATTERNS.items():
+        m = pattern.match(indicator)
+        if m is not None:
+            window = int(m.group(1)) if kind in ("rsi", "cci", "dx", "sma") else None
+            return kind, window
+    return None
+
+
+def is_supported(indicator):
+    return parse(indicator) is not None
+
+
+def ema(x, span):
+    return x.ewm(span=span, min_periods=0, adjust=True, ignore_na=False).mean()
+
+
+def smma(x, window):
+    return x.ewm(alpha=1.0 / window, min_periods=0, adjust=True, ignore_na=False).mean()
+
+
+def sma(x, window):
+    return x.rolling(window, min_periods=1).mean()
+
+
+def rolling_mad(x, window, chunk_size=2 ** 22):
+    """Rolling mean absolute deviation with partial windows at the start,
+    computed on a strided [T x N x window] view in chunks of dates
+    """
+    values = x.values.astype(float)
+    padded = np.concatenate([np.full((window - 1, values.shape[1]), np.nan), values])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0)
+    step = max(1, chunk_size // (values.shape[1] * window))
+    mad = np.empty_like(values)
+    for start in range(0, len(values), step):
+        w = windows[start : start + step]
+        mean = np.nanmean(w, axis=-1, keepdims=True)
+        mad[start : start + step] = np.nanmean(np.abs(w - mean), axis=-1)
+    return pd.DataFrame(mad, index=x.index, columns=x.columns)
+
+
+def macd(close):
+    return ema(close, MACD_EMA_SHORT) - ema(close, MACD_EMA_LONG)
+
+
+def boll(close, band):
+    width = BOLL_STD_TIMES * close.rolling(BOLL_PERIOD, min_periods=1).std()
+    return sma(close, BOLL_PERIOD) + (width if band == "ub" else -width)
+
+
+def rsi(close, window):
+    change = close.diff().fillna(0.0)
+    rs = smma((change + change.abs()) / 2, window) / smma((change.abs() - change) / 2, window)
+    return 100 - 100 / (1.0 + rs)
+
+
+def cci(close, high, low, window):
+    tp = (close + high + low) / 3.0
+    return (tp - sma(tp, window)) / (.015 * rolling_mad(tp, window))
+
+
+def dx(close, high, low, window):
+    high_delta = high.diff()
+    low_delta = -low.diff()
+    um = (high_delta + high_delta.abs()) / 2
+    dm = (low_delta + low_delta.abs()) / 2
+    pdm = um.where(um > dm, 0)
+    mdm = dm.where(dm > um, 0)
+    if window > 1:
+        pdm, mdm = ema(pdm, window), ema(mdm, window)
+
+    prev_close = close.shift(1)
+    prev_close.iloc[0] = close.iloc[0]
+    tr = np.maximum(
+        np.maximum(high - low, (high - prev_close).abs()), (low - prev_close).abs()
+    )
+    atr = smma(tr, window)
+
+    pdi = pdm / atr * 100
+    mdi = mdm / atr * 100
+    return (pdi - mdi).abs() / (pdi + mdi) * 100
+
+
+def compute(close, high, low, indicator_list):
+    """Computes indicators for all tickers at once
+    :param close, high, low: (df) [date x tic] wide pandas dataframes
+    :param indicator_list: (list) supported indicator names
+    :return: (dict) indicator name -> [date x tic] wide pandas dataframe
+    """
+    result = {}
+    for indicator in indicator_list:
+        kind, window = parse(indicator)
+        if kind == "macd":
+            result[indicator] = macd(close)
+        elif kind == "boll":
+            result[indicator] = boll(close, indicator[-2:])
+        elif kind == "rsi":
+            result[indicator] = rsi(close, window)
+        elif kind == "cci":
+            result[indicator] = cci(close, high, low, window)
+        elif kind == "dx":
+            result[indicator] = dx(close, high, low, window)
+        elif kind == "sma":
+            result[indicator] = sma(close, window)
+    return result
+
+
+class IndicatorState:
+    """Rolling state of the supported indicators for a fixed set of tickers,
+    so that new bars are added in O(new bars) instead of recomputing history
+    Attributes
+    ----------
+        tics: list
+            ticker names, the column order of every array
+        indicator_list: list
+            supported indicator names
+        dates: list
+            dates of the bars added so far
+    Methods
+    -------
+        update()
+            add one bar of close/high/low prices and return its indicators
+        rollback()
+            remove the last added bar, e.g. to replace an incomplete bar
+        get()
+            return the inputs and indicators stored for a date
+    Notes
+    -----
+        EMA/SMMA (MACD, RSI, DX) keep the adjusted weighted average and its
+        weight as pandas does, windowed values (SMA, Bollinger, CCI) keep a
+        ring buffer of the last `window` bars.
+    """
+    def __init__(self, tics, indicator_list):
+        self.tics = list(tics)
+        self.indicator_list = list(indicator_list)
+        self.parsed = [parse(indicator) for indicator in self.indicator_list]
+        self.dates = []
+        self._inputs = {}
+        self._values = {}
+        self._checkpoint = None
+
+        close_windows = [
+            BOLL_PERIOD if kind == "boll" else window
+            for kind, window in self.parsed if kind in ("boll", "sma")
+        ]
+        tp_windows = [window for kind, window in self.parsed if kind == "cci"]
+        num_tics = len(self.tics)
+        self._state = dict(
+            count = 0,
+            prev = None,
+            ewm = {},
+            close_buffer = np.zeros((max(close_windows, default=1), num_tics)),
+            tp_buffer = np.zeros((max(tp_windows, default=1), num_tics)),
+        )
+
+
+    def _ewm(self, key, x, alpha):
+        # adjusted exponentially weighted mean, same recursion as pandas
+        if key not in self._state["ewm"]:
+            self._state["ewm"][key] = (x.astype(float), 1.0)
+            return x.astype(float)
+        weighted, old_wt = self._state["ewm"][key]
+        old_wt *= 1 - alpha
+        weighted = np.where(
+            weighted != x, (old_wt * weighted + x) / (old_wt + 1.0), weighted
+        )
+        self._state["ewm"][key] = (weighted, old_wt + 1.0)
+        return weighted
+
+
+    def _window(self, buffer, window):
+        # last min(window, count) bars of a ring buffer, newest first
+        count = self._state["count"]
+        size = min(window, count)
+        return buffer[(count - 1 - np.arange(size)) % len(buffer)]
+
+
+    def update(self, date, close, high, low):
+        """Adds one bar
+        :param date: (str) date of the bar, after the last added one
+        :param close, high, low: (np.ndarray) prices in `tics` order
+        :return: (np.ndarray) [indicator x tic] values of the bar
+        """
+        self._checkpoint = self._snapshot()
+        state = self._state
+        prev_close, prev_high, prev_low = state["prev"] if state["prev"] is not None else (close, None, None)
+        tp = (close + high + low) / 3.0
+
+        state["close_buffer"][state["count"] % len(state["close_buffer"])] = close
+        state["tp_buffer"][state["count"] % len(state["tp_buffer"])] = tp
+        state["count"] += 1
+
+        values = np.empty((len(self.indicator_list), len(self.tics)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for i, (kind, window) in enumerate(self.parsed):
+                if kind == "macd":
+                    values[i] = self._ewm("ema_short", close, 2.0 / (MACD_EMA_SHORT + 1)) - \
+                        self._ewm("ema_long", close, 2.0 / (MACD_EMA_LONG + 1))
+                elif kind == "boll":
+                    w = self._window(state["close_buffer"], BOLL_PERIOD)
+                    std = w.std(axis=0, ddof=1) if len(w) > 1 else np.full(len(self.tics), np.nan)
+                    width = BOLL_STD_TIMES * std
+                    values[i] = w.mean(axis=0) + (width if self.indicator_list[i] == "boll_ub" else -width)
+                elif kind == "sma":
+                    values[i] = self._window(state["close_buffer"], window).mean(axis=0)
+                elif kind == "rsi":
+                    change = close - prev_close
+                    p_ema = self._ewm(("rsi_p", window), (change + np.abs(change)) / 2, 1.0 / window)
+                    n_ema = self._ewm(("rsi_n", window), (np.abs(change) - change) / 2, 1.0 / window)
+                    values[i] = 100 - 100 / (1.0 + p_ema / n_ema)
+                elif kind == "cci":
+                    w = self._window(state["tp_buffer"], window)
+                    mean = w.mean(axis=0)
+                    mad = np.abs(w - mean).mean(axis=0)
+                    values[i] = (tp - mean) / (.015 * mad)
+                elif kind == "dx":
+                    if prev_high is None:
+                        pdm = mdm = np.zeros(len(self.tics))
+                    else:
+                        um = np.maximum(high - prev_high, 0)
+                        dm = np.maximum(prev_low - low, 0)
+                        pdm = np.where(um > dm, um, 0)
+                        mdm = np.where(dm > um, dm, 0)
+                    if window > 1:
+                        pdm = self._ewm(("dx_p", window), pdm, 2.0 / (window + 1))
+                        mdm = self._ewm(("dx_m", window), mdm, 2.0 / (window + 1))
+                    tr = np.maximum.reduce([
+                        high - low, np.abs(high - prev_close), np.abs(low - prev_close)
+                    ])
+                    atr = self._ewm(("dx_tr", window), tr, 1.0 / window)
+                    pdi, mdi = pdm / atr * 100, mdm / atr * 100
+                    values[i] = np.abs(pdi - mdi) / (pdi + mdi) * 100
+
+        state["prev"] = (close, high, low)
+        self.dates.append(date)
+        self._inputs[date] = np.stack([close, high, low])
+        self._values[date] = values
+        return values
+
+
+    def rollback(self):
+        if self._checkpoint is None:
+            raise ValueError("only the last added bar can be rolled back")
+        date = self.dates.pop()
+        del self._inputs[date], self._values[date]
+        self._state = self._checkpoint
+        self._checkpoint = None
+
+
+    def get(self, date):
+        return self._inputs[date], self._values[date]
+
+
+    def __contains__(self, date):
+        return date in self._inputs
+
+
+    def _snapshot(self):
+        state = dict(self._state)
+        state["ewm"] = dict(state["ewm"])
+        state["close_buffer"] = state["close_buffer"].copy()
+        state["tp_buffer"] = state["tp_buffer"].copy()
+        return state
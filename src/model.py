@@ -1,9 +1,115 @@
 import gym
+import functools
 import numpy as np
 import pandas as pd
 from gym import spaces
 from gym.utils import seeding
-from stable_baselines3.common.vec_env import DummyVecEnv
+from multiprocessing import shared_memory
+
+
+def softmax(actions):
+    # Allocations of raw actions, on the last axis
+    numerator = np.exp(actions)
+    return numerator / numerator.sum(axis=-1, keepdims=True)
+
+
+def market_arrays(df, stock_dim, tech_indicator_list, covs):
+    """Builds the contiguous arrays of StockPortfolioEnv from a dataframe
+    :param df: (df) data with one row per (date, tic), indexed by day
+    :param covs: (np.ndarray) [T x N x N] covariances of the dates of df
+    :return: (dict)
+        dates: [T] dates
+        tics: [N] ticker names
+        closes: [T x N] close prices
+        obs: [T x (N + K) x N] float32 observations, covariances over
+            indicators
+        covs: [T x N x N] float32 covariances, a view of obs
+    """
+    dates = df.date.unique()
+    n_days = len(dates)
+    if len(df) != n_days * stock_dim:
+        raise ValueError("every date needs one row per stock.")
+
+    if len(covs) != n_days:
+        raise ValueError("every date needs one covariance matrix.")
+
+    closes = df.close.values.reshape(n_days, stock_dim)
+    techs = df[tech_indicator_list].values.reshape(
+        n_days, stock_dim, len(tech_indicator_list)
+    ).transpose(0, 2, 1)
+    # the observations hold the only copy of the covariances, in float32
+    # like the observation space
+    obs = np.empty((n_days, stock_dim + len(tech_indicator_list), stock_dim), dtype=np.float32)
+    obs[:, :stock_dim] = covs
+    obs[:, stock_dim:] = techs
+    return dict(
+        dates = dates,
+        tics = df.loc[0, "tic"].values,
+        closes = np.ascontiguousarray(closes),
+        obs = obs,
+        covs = obs[:, :stock_dim],
+    )
+
+
+class SharedArrays:
+    """Places the arrays of a StockPortfolioEnv in shared memory, so that
+    worker processes map them instead of receiving pickled copies
+    Attributes
+    ----------
+        spec: dict
+            picklable description of the arrays, see attach_arrays()
+    Methods
+    -------
+        close()
+            release and remove the shared memory blocks
+    Notes
+    -----
+        Arrays of a memory-mapped dataset (see dataset.read()) are not
+        copied, workers map the same files.
+    """
+    SHARED = ("closes", "obs")
+
+    def __init__(self, arrays):
+        self.blocks = []
+        if "path" in arrays:
+            self.spec = dict(path=arrays["path"])
+            return
+        self.spec = dict(dates=arrays["dates"], tics=arrays["tics"])
+        for name in self.SHARED:
+            array = arrays[name]
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, array.dtype, buffer=shm.buf)[:] = array
+            self.blocks.append(shm)
+            self.spec[name] = (shm.name, array.shape, array.dtype.str)
+
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+
+def attach_arrays(spec):
+    # Maps the arrays described by SharedArrays.spec in this process
+    if "path" in spec:
+        from src import dataset
+        return dataset.read(spec["path"])
+    arrays = dict(dates=spec["dates"], tics=spec["tics"], blocks=[])
+    for name in SharedArrays.SHARED:
+        shm_name, shape, dtype = spec[name]
+        # workers share the resource tracker of the creating process,
+        # which owns (and unlinks) the block
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arrays["blocks"].append(shm)
+        arrays[name] = np.ndarray(shape, dtype, buffer=shm.buf)
+    arrays["covs"] = arrays["obs"][:, : len(arrays["tics"])]
+    return arrays
+
+
+def make_shared_env(spec, env_kwargs):
+    # Environment factory of the worker processes
+    return StockPortfolioEnv(df=None, arrays=attach_arrays(spec), **env_kwargs)
 
 
 
@@ -33,6 +139,13 @@ class StockPortfolioEnv(gym.Env):
             equals stock dimension
         day: int
             an increment number to control date
+        record: bool
+            whether to record the episode memories (disable for training)
+        covs: np.ndarray
+            covariances of the dates of df (see data.main())
+        arrays: dict
+            precomputed arrays (see market_arrays() and dataset.read())
+            used instead of df and covs
     Methods
     -------
     _sell_stock()
@@ -67,8 +180,12 @@ class StockPortfolioEnv(gym.Env):
         turbulence_threshold=None,
         lookback=252,
         day=0,
+        record=True,
+        covs=None,
+        arrays=None,
     ):
         self.day = day
+        self.record = record
         self.lookback = lookback
         self.df = df
         self.stock_dim = stock_dim
@@ -95,38 +212,73 @@ class StockPortfolioEnv(gym.Env):
             ),
         )
 
-        # load data from a pandas dataframe
-        self.data = self.df.loc[self.day, :]
-        self.covs = self.data["cov_list"].values[0]
-        self.state = np.append(
-            np.array(self.covs),
-            [self.data[tech].values.tolist() for tech in self.tech_indicator_list],
-            axis=0)
+        # load data from a pandas dataframe into dense arrays
+        if arrays is None:
+            arrays = market_arrays(self.df, self.stock_dim, self.tech_indicator_list, covs)
+        self.arrays = arrays
+        self.dates = arrays["dates"]
+        self.tics = arrays["tics"]
+        self.closes = arrays["closes"]
+        self.obs = arrays["obs"]
+        self.daily_covs = arrays["covs"]
+        self.n_days = len(self.dates)
+        self.covs = self.daily_covs[self.day]
+        self.state = self.obs[self.day]
         self.terminal = False
         self.turbulence_threshold = turbulence_threshold
         self.portfolio_value = self.initial_amount
+        self.last_allocation = np.asarray(self.initial_allocation, dtype=float)
+
+        # memorize values each step, an episode has at most n_days entries
+        self._asset_buffer = np.empty(self.n_days)
+        self._return_buffer = np.empty(self.n_days)
+        self._action_buffer = np.empty((self.n_days, self.stock_dim))
+        self._day_buffer = np.empty(self.n_days, dtype=int)
+        self._memory_size = 0
+        self._remember(self.initial_amount, 0, self.last_allocation)
+
+
+    def _remember(self, asset, portfolio_return, allocation):
+        if self.record:
+            i = self._memory_size
+            self._asset_buffer[i] = asset
+            self._return_buffer[i] = portfolio_return
+            self._action_buffer[i] = allocation
+            self._day_buffer[i] = self.day
+            self._memory_size += 1
 
-        # memorize values each step
-        self.asset_memory = [self.initial_amount]
-        self.portfolio_return_memory = [0]
-        self.actions_memory = [self.initial_allocation]
-        self.date_memory = [self.data.date.unique()[0]]
+
+    @property
+    def asset_memory(self):
+        return self._asset_buffer[: self._memory_size]
+
+
+    @property
+    def portfolio_return_memory(self):
+        return self._return_buffer[: self._memory_size]
+
+
+    @property
+    def actions_memory(self):
+        return self._action_buffer[: self._memory_size]
+
+
+    @property
+    def date_memory(self):
+        return self.dates[self._day_buffer[: self._memory_size]]
 
 
     def step(self, actions):
-        self.terminal = self.day >= len(self.df.index.unique()) - 1
+        self.terminal = self.day >= self.n_days - 1
 
         if self.terminal:
-            df = pd.DataFrame(self.portfolio_return_memory)
-            df.columns = ["daily_return"]
-
             # print("begin_total_asset:{}".format(self.asset_memory[0]))
             # print("end_total_asset:{}".format(self.portfolio_value))
 
             # Calculate sharpe ratio
             df_daily_return = pd.DataFrame(self.portfolio_return_memory)
             df_daily_return.columns = ["daily_return"]
-            if df_daily_return["daily_return"].std() != 0:
+            if self.record and df_daily_return["daily_return"].std() != 0:
                 sharpe = (
                     (252**0.5)
                     * df_daily_return["daily_return"].mean()
@@ -138,26 +290,19 @@ class StockPortfolioEnv(gym.Env):
 
         else:
             allocation = self.softmax_normalization(actions)
-            self.actions_memory.append(allocation)
-            last_day_memory = self.data
 
             # load next state
             self.day += 1
-            self.data = self.df.loc[self.day, :]
-            self.covs = self.data["cov_list"].values[0]
-            self.state = np.append(
-                np.array(self.covs),
-                [self.data[tech].values.tolist() for tech in self.tech_indicator_list],
-                axis=0,
-            )
+            self.covs = self.daily_covs[self.day]
+            self.state = self.obs[self.day]
 
             # Ratio of portfolio return (in [-1, 1])
             return_ratio = sum(
-                ((self.data.close.values / last_day_memory.close.values) - 1) * allocation)
+                ((self.closes[self.day] / self.closes[self.day - 1]) - 1) * allocation)
 
             # Calculate commission fee
             commission_fee = self.commission_perc / 100 * self.portfolio_value * \
-                np.sum(np.abs(allocation - self.actions_memory[-2]))
+                np.sum(np.abs(allocation - self.last_allocation))
             commission_ratio = commission_fee / self.portfolio_value
 
             # New portfolio value
@@ -171,30 +316,24 @@ class StockPortfolioEnv(gym.Env):
             # print(commission_fee, commission_ratio * 100)
 
             # Save into memory
-            self.portfolio_return_memory.append(return_ratio)
-            self.date_memory.append(self.data.date.unique()[0])
-            self.asset_memory.append(self.portfolio_value)
+            self.last_allocation = allocation
+            self._remember(self.portfolio_value, return_ratio, allocation)
 
         return self.state, self.reward, self.terminal, {}
 
 
     def reset(self):
         self.day = 0
-        self.data = self.df.loc[self.day, :]
-
-        self.asset_memory = [self.initial_amount]
-        self.actions_memory = [self.initial_allocation]
-        self.date_memory = [self.data.date.unique()[0]]
 
         self.portfolio_value = self.initial_amount
+        self.last_allocation = np.asarray(self.initial_allocation, dtype=float)
         self.terminal = False
-        self.portfolio_return_memory = [0]
 
-        self.covs = self.data["cov_list"].values[0]
-        self.state = np.append(
-            np.array(self.covs),
-            [self.data[tech].values.tolist() for tech in self.tech_indicator_list],
-            axis=0)
+        self._memory_size = 0
+        self._remember(self.initial_amount, 0, self.last_allocation)
+
+        self.covs = self.daily_covs[self.day]
+        self.state = self.obs[self.day]
         return self.state
 
 
@@ -203,30 +342,27 @@ class StockPortfolioEnv(gym.Env):
 
 
     def softmax_normalization(self, actions):
-        numerator = np.exp(actions)
-        denominator = np.sum(np.exp(actions))
-        softmax_output = numerator / denominator
-        return softmax_output
+        return softmax(actions)
 
 
+    # The saved memories are views of the episode buffers, copy them to
+    # keep them after reset()
     def save_asset_memory(self):
         date_list = self.date_memory
         portfolio_return = self.portfolio_return_memory
         df_account_value = pd.DataFrame(
-            {"date": date_list, "daily_return": portfolio_return}
+            {"date": date_list, "daily_return": portfolio_return}, copy=False
         )
         return df_account_value
 
 
     def save_action_memory(self):
-        date_list = self.date_memory
-        df_date = pd.DataFrame(date_list)
-        df_date.columns = ["date"]
-
-        action_list = self.actions_memory
-        df_actions = pd.DataFrame(action_list)
-        df_actions.columns = self.data.tic.values
-        df_actions.index = df_date.date
+        df_actions = pd.DataFrame(
+            self.actions_memory,
+            columns=self.tics,
+            index=pd.Index(self.date_memory, name="date"),
+            copy=False,
+        )
         return df_actions
 
 
@@ -236,6 +372,43 @@ class StockPortfolioEnv(gym.Env):
 
 
     def get_sb_env(self):
+        from stable_baselines3.common.vec_env import DummyVecEnv
         e = DummyVecEnv([lambda: self])
         obs = e.reset()
         return e, obs
+
+
+    def get_env_kwargs(self):
+        return dict(
+            stock_dim = self.stock_dim,
+            initial_amount = self.initial_amount,
+            initial_allocation = self.initial_allocation,
+            commission_perc = self.commission_perc,
+            state_space = self.state_space,
+            action_space = self.action_space.shape[0],
+            tech_indicator_list = self.tech_indicator_list,
+            reward_scaling = self.reward_scaling,
+            turbulence_threshold = self.turbulence_threshold,
+            lookback = self.lookback,
+            record = self.record,
+        )
+
+
+    def get_sb_subproc_env(self, n_envs, start_method=None):
+        # Copies of this environment in worker processes sharing its arrays,
+        # call `shared_arrays.close()` after closing the returned env
+        from stable_baselines3.common.vec_env import SubprocVecEnv
+        self.shared_arrays = SharedArrays(self.arrays)
+        env_fn = functools.partial(
+            make_shared_env, self.shared_arrays.spec, self.get_env_kwargs()
+        )
+        e = SubprocVecEnv([env_fn] * n_envs, start_method=start_method)
+        obs = e.reset()
+        return e, obs
+
+
+    def get_sb_vec_env(self, n_envs, max_start_day=0, seed=None):
+        from src.vec_env import StockPortfolioVecEnv
+        e = StockPortfolioVecEnv(self, n_envs, max_start_day=max_start_day, seed=seed)
+        obs = e.reset()
+        return e, obs
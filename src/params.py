@@ -23,6 +23,17 @@ def main():
             ['2023-04-01', '2023-05-01'],
             ['2023-05-01', '2023-06-01'],
         ],
+
+        cache_dir = './cache/',  # local price and feature stores consulted before downloading (None to disable)
+
+        # Price source: 'yahoo', 'local' (dir of <tic>.csv/.parquet) or 'synthetic' (seeded GBM)
+        source = 'yahoo',
+        source_kwargs = {},  # e.g. dict(data_dir='./prices/') or dict(seed=42, sigma=0.02)
+        max_workers = 8,  # number of tickers downloaded concurrently
+        incremental_indicators = False,  # compute the indicators bar by bar, stored features are then extended with new bars only
+        warmup_years = None,  # indicators start on Jan 1 this many years before the start year, e.g. 1 (None: at the start date)
+        lookback = None,  # days of returns in the covariance states, e.g. 252 (None: whole window)
+        dataset_dir = './datasets/',  # memory-mapped datasets of training / backtest ranges (None to disable)
     )
 
     # Environment parameters
@@ -97,4 +108,14 @@ def main():
         progress_bar = True,
     )
 
-    return data_params, env_params, model_params, train_params, model_name
+    # Training run settings, not arguments of learn()
+    run_params = dict(
+        n_envs = 1,  # number of environment copies (1: single DummyVecEnv env)
+        vec_env = 'batch',  # 'batch': one batched NumPy env, 'subproc': one process per copy
+        max_start_day = 0,  # batched episodes start at a random day in [0, max_start_day]
+        checkpoint_freq = 2 ** 12,  # timesteps between checkpoints (0: no checkpoints)
+        checkpoint_dir = './checkpoints/',  # an interrupted training resumes from its latest checkpoint
+        keep_checkpoints = 3,  # number of most recent checkpoints kept
+    )
+
+    return data_params, env_params, model_params, train_params, run_params, model_name
@@ -1,29 +1,32 @@
 import os
 import streamlit as st
 
-from src import data, model, agent
+from src import dataset, model, agent, export
 
 
 def main(data_params, env_kwargs, model_name, date):
-    # Get data
-    test = data.main(
-        stocks = data_params['stocks'],
-        date = date,
-    )
-
     # Create environment
     test_env = model.StockPortfolioEnv(
-        df = test,
+        df = None,
+        arrays = dataset.arrays(data_params, env_kwargs, date),
         **env_kwargs
     )
 
-    # Predict
-    df_daily_return_ppo, df_actions_ppo = agent.Agent.predict(
-        model_name = model_name,
-        environment = test_env,
-        cwd = os.path.join('src', model_name),
-        deterministic = True,
-    )
+    # Predict, with the exported NumPy policy if it is up to date
+    policy = export.load(os.path.join('src', model_name))
+    if policy is not None:
+        df_daily_return_ppo, df_actions_ppo = agent.Agent.predict_batch(
+            model = policy,
+            environment = test_env,
+            deterministic = True,
+        )
+    else:
+        df_daily_return_ppo, df_actions_ppo = agent.Agent.predict(
+            model_name = model_name,
+            environment = test_env,
+            cwd = os.path.join('src', model_name),
+            deterministic = True,
+        )
     next_allocation = df_actions_ppo * env_kwargs['initial_amount']
 
     return next_allocation
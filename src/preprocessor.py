@@ -1,9 +1,10 @@
 import datetime
+import threading
 import numpy as np
 import pandas as pd
 from stockstats import StockDataFrame as Sdf
 
-from src import downloader
+from src import downloader, indicators
 
 
 INDICATORS = [
@@ -17,6 +18,13 @@ INDICATORS = [
     "close_60_sma",
 ]
 
+# Indicator states of the incremental mode, keyed by tickers, indicators and
+# first date: a state only continues the calls starting at the same date, so
+# the indicators of a call do not depend on the calls made before it
+INDICATOR_STATES = {}
+MAX_INDICATOR_STATES = 16  # the oldest states are dropped beyond this
+_STATES_LOCK = threading.Lock()
+
 
 def data_split(df, start, end, target_date_col="date"):
     # split the dataset into training or testing using date
@@ -26,6 +34,83 @@ def data_split(df, start, end, target_date_col="date"):
     return data
 
 
+def rolling_covariance(returns, lookback):
+    """
+    covariance of the returns over a rolling window, for every window at once
+    from prefix sums of the (centered) returns and their outer products
+    :param returns: (np.ndarray) [date x tic] returns, the first row is ignored
+    :param lookback: (int) number of prices in a window, i.e. lookback - 1
+        returns and the current one
+    :return: (np.ndarray) [date - lookback x tic x tic] covariance of the
+        returns in rows i - lookback + 1 ... i, for i = lookback ... date - 1
+    """
+    x = returns[1:] - returns[1:].mean(axis=0)
+    s1 = np.concatenate([np.zeros((1,) + x.shape[1:]), np.cumsum(x, axis=0)])
+    s2 = np.concatenate([
+        np.zeros((1,) + x.shape[1:] * 2),
+        np.cumsum(x[:, :, None] * x[:, None, :], axis=0),
+    ])
+    sum1 = s1[lookback:] - s1[:-lookback]
+    sum2 = s2[lookback:] - s2[:-lookback]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (sum2 - sum1[:, :, None] * sum1[:, None, :] / lookback) / (lookback - 1)
+
+
+def return_windows(returns, lookback):
+    """
+    rolling windows of the returns, without copying them
+    :param returns: (np.ndarray) [date + lookback - 1 x tic] returns
+    :param lookback: (int) number of returns in a window
+    :return: (np.ndarray) [date x lookback x tic] read-only view, window i
+        holds rows i ... i + lookback - 1
+    """
+    return np.lib.stride_tricks.sliding_window_view(returns, lookback, axis=0).transpose(0, 2, 1)
+
+
+def rolling_turbulence(returns, window=252, chunk_size=256):
+    """
+    Mahalanobis distance of each day's returns from the mean and covariance
+    of the previous `window` days, in batches of days without a loop per date
+    :param returns: (np.ndarray) [date x tic] returns without missing values
+        but in the first row, which is ignored
+    :param window: (int) number of previous returns, the first window only
+        has window - 1 of them since the first row is ignored
+    :param chunk_size: (int) number of days whose covariances are built at once
+    :return: (np.ndarray) [date - window] distances of days window ... date - 1
+    """
+    n_days = len(returns)
+    distances = np.empty(max(n_days - window, 0))
+    if len(distances) == 0:
+        return distances
+
+    # first day, window - 1 returns
+    hist = returns[1:window]
+    distances[0] = _mahalanobis(
+        np.atleast_2d(np.cov(hist, rowvar=False))[None],
+        (returns[window] - hist.mean(axis=0))[None],
+    )[0]
+
+    # every later day i, returns i - window ... i - 1
+    s1 = np.concatenate([np.zeros((1, returns.shape[1])), np.cumsum(returns[1:], axis=0)])
+    for start in range(window + 1, n_days, chunk_size):
+        end = min(start + chunk_size, n_days)
+        covs = rolling_covariance(returns[start - window - 1 : end], window)[: end - start]
+        means = (s1[start - 1 : end - 1] - s1[start - window - 1 : end - window - 1]) / window
+        distances[start - window : end - window] = _mahalanobis(covs, returns[start:end] - means)
+    return distances
+
+
+def _mahalanobis(covs, deviations):
+    # x' pinv(cov) x of each day, with Cholesky solves if every covariance
+    # of the batch is positive definite and the pseudo-inverse otherwise
+    try:
+        lower = np.linalg.cholesky(covs)
+        z = np.linalg.solve(lower, deviations[..., None])[..., 0]
+        return np.sum(z * z, axis=1)
+    except np.linalg.LinAlgError:
+        return np.einsum("ij,ijk,ik->i", deviations, np.linalg.pinv(covs), deviations)
+
+
 def convert_to_datetime(time):
     time_fmt = "%Y-%m-%dT%H:%M:%S"
     if isinstance(time, str):
@@ -41,12 +126,19 @@ class FeatureEngineer:
         use_vix=False,
         use_turbulence=False,
         user_defined_feature=False,
+        incremental=False,
+        indicator_state=None,
     ):
         self.use_technical_indicator = use_technical_indicator
         self.tech_indicator_list = tech_indicator_list
         self.use_vix = use_vix
         self.use_turbulence = use_turbulence
         self.user_defined_feature = user_defined_feature
+        # keep the indicator state between calls and only add the new bars
+        self.incremental = incremental
+        # state to continue instead of the stored one of the same first date,
+        # then the state after the last bar
+        self.indicator_state = indicator_state
 
 
     def preprocess_data(self, df):
@@ -111,8 +203,108 @@ class FeatureEngineer:
     def add_technical_indicator(self, data):
         """
         calculate technical indicators
+        supported indicators (see `indicators.PATTERNS`) are computed for all
+        tickers at once on [date x tic] arrays, the others with stockstats
+        :param data: (df) pandas dataframe
+        :return: (df) pandas dataframe
+        """
+        df = data.sort_values(by=["date", "tic"], ignore_index=True)
+        supported = [i for i in self.tech_indicator_list if indicators.is_supported(i)]
+        others = [i for i in self.tech_indicator_list if not indicators.is_supported(i)]
+
+        # stockstats works on each ticker's own rows, so missing dates of a
+        # ticker are only handled by the per-ticker path
+        num_dates, num_tics = df.date.nunique(), df.tic.nunique()
+        if len(df) != num_dates * num_tics:
+            return self.add_stockstats_indicator(df, self.tech_indicator_list)
+
+        close, high, low = [
+            df.pivot(index="date", columns="tic", values=column)
+            for column in ["close", "high", "low"]
+        ]
+        if self.incremental:
+            indicator_values = self.update_indicator_state(close, high, low, supported)
+        else:
+            indicator_values = indicators.compute(close, high, low, supported)
+
+        date_idx = close.index.get_indexer(df.date)
+        tic_idx = close.columns.get_indexer(df.tic)
+        for indicator, values in indicator_values.items():
+            df[indicator] = values.values[date_idx, tic_idx]
+
+        if len(others) > 0:
+            df = self.add_stockstats_indicator(df, others)
+        return df
+
+
+    def update_indicator_state(self, close, high, low, indicator_list):
+        """
+        add the bars newer than the indicator state of these tickers (the
+        given one, else the stored one starting at the same date), the state
+        is rebuilt if the dates do not overlap it or if a bar other than the
+        last one has changed (e.g. adjusted prices)
+        :param close, high, low: (df) [date x tic] wide pandas dataframes
+        :param indicator_list: (list) supported indicator names
+        :return: (dict) indicator name -> [date x tic] wide pandas dataframe
+        """
+        dates = close.index
+        inputs = np.stack([close.values, high.values, low.values], axis=1)
+        key = (tuple(close.columns), tuple(indicator_list))
+
+        # Streamlit sessions share the stored states from several threads
+        with _STATES_LOCK:
+            state = self.indicator_state
+            if state is None:
+                state = INDICATOR_STATES.get(key + (dates[0],))
+            values = self._update_state(state, key, dates, inputs)
+
+        return {
+            indicator: pd.DataFrame(values[:, i], index=close.index, columns=close.columns)
+            for i, indicator in enumerate(indicator_list)
+        }
+
+
+    def _update_state(self, state, key, dates, inputs):
+        if state is not None and (tuple(state.tics), tuple(state.indicator_list)) != key:
+            state = None
+        if state is not None and dates[0] in state:
+            for i in range(len(dates)):
+                if dates[i] > state.dates[-1]:
+                    break
+                if dates[i] not in state:
+                    state = None
+                    break
+                if not np.allclose(state.get(dates[i])[0], inputs[i]):
+                    if dates[i] == state.dates[-1]:
+                        # the last bar was incomplete, replace it
+                        state.rollback()
+                    else:
+                        state = None
+                    break
+        else:
+            state = None
+
+        if state is None:
+            state = indicators.IndicatorState(*key)
+        for i in range(len(dates)):
+            if len(state.dates) == 0 or dates[i] > state.dates[-1]:
+                state.update(dates[i], *inputs[i])
+
+        INDICATOR_STATES.pop(key + (state.dates[0],), None)
+        INDICATOR_STATES[key + (state.dates[0],)] = state
+        while len(INDICATOR_STATES) > MAX_INDICATOR_STATES:
+            INDICATOR_STATES.pop(next(iter(INDICATOR_STATES)))
+        self.indicator_state = state
+
+        return np.stack([state.get(date)[1] for date in dates])
+
+
+    def add_stockstats_indicator(self, data, indicator_list):
+        """
+        calculate technical indicators ticker by ticker
         use stockstats package to add technical inidactors
         :param data: (df) pandas dataframe
+        :param indicator_list: (list) indicator names
         :return: (df) pandas dataframe
         """
         df = data.copy()
@@ -120,7 +312,7 @@ class FeatureEngineer:
         stock = Sdf.retype(df.copy())
         unique_ticker = stock.tic.unique()
 
-        for indicator in self.tech_indicator_list:
+        for indicator in indicator_list:
             indicator_df = pd.DataFrame()
             for i in range(len(unique_ticker)):
                 try:
@@ -195,6 +387,27 @@ class FeatureEngineer:
 
 
     def calculate_turbulence(self, data):
+        """calculate turbulence index based on dow 30
+        with batched covariances, falling back to calculate_turbulence_loop()
+        if a ticker misses prices
+        """
+        df = data.copy()
+        df_price_pivot = df.pivot(index="date", columns="tic", values="close")
+        returns = df_price_pivot.pct_change().values
+        if np.isnan(returns[1:]).any():
+            return self.calculate_turbulence_loop(data)
+
+        # start after a year
+        start = 252
+        turbulence = np.zeros(len(returns))
+        distances = rolling_turbulence(returns, start)
+        # avoid large outlier because of the calculation just begins
+        positive = distances > 0
+        turbulence[start:] = np.where(positive & (np.cumsum(positive) > 2), distances, 0)
+        return pd.DataFrame({"date": df_price_pivot.index, "turbulence": turbulence})
+
+
+    def calculate_turbulence_loop(self, data):
         """calculate turbulence index based on dow 30"""
         # can add other market assets
         df = data.copy()
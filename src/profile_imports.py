@@ -0,0 +1,83 @@
+# Import time of the app entry points, parsed from python -X importtime
+# python -m src.profile_imports [module ...] [--json report.json]
+
+import sys
+import json
+import argparse
+import subprocess
+
+
+MODULES = ["Home", "src.predict", "src.train"]
+
+
+def import_times(module):
+    """Imports a module in a new interpreter
+    :param module: (str) module name
+    :return: (list) dict(name, depth, self_ms, cumulative_ms) of every
+        imported module, in import order
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append(dict(
+            name = name.strip(),
+            # nested imports are indented by two spaces per level
+            depth = (len(name) - len(name.lstrip()) - 1) // 2,
+            self_ms = int(self_us) / 1000,
+            cumulative_ms = int(cumulative_us) / 1000,
+        ))
+    return times
+
+
+def report(modules=MODULES, top=10):
+    # Total import time of each module and the slowest packages it imports,
+    # summing the own time of every submodule of a package
+    result = {}
+    for module in modules:
+        try:
+            times = import_times(module)
+        except ImportError as e:
+            result[module] = dict(error=str(e))
+            continue
+        packages = {}
+        for t in times:
+            package = t["name"].split(".")[0]
+            packages[package] = packages.get(package, 0.) + t["self_ms"]
+        result[module] = dict(
+            total_ms = round(sum(t["self_ms"] for t in times), 1),
+            slowest = {
+                package: round(ms, 1)
+                for package, ms in sorted(packages.items(), key=lambda p: -p[1])[:top]
+            },
+        )
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    result = report(args.modules)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    for module, times in result.items():
+        if "error" in times:
+            print(f'{module}: {times["error"]}')
+            continue
+        print(f'{module}: {times["total_ms"]:.0f} ms')
+        for name, ms in times["slowest"].items():
+            print(f'{name:>30}: {ms:.0f} ms')
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+
+
+class ModelRegistry:
+    """In-process cache of loaded models, so that repeated predictions and
+    trainings do not unpack the same archive again
+    Attributes
+    ----------
+        models: dict
+            absolute archive path -> entry with the model, the archive
+            modification time, the load time and the parameter size
+    Methods
+    -------
+        get()
+            return the cached model of an archive, loading it if the archive
+            is new or has changed since it was cached
+        put()
+            cache a model just saved to an archive
+        invalidate()
+            drop the cached model of an archive
+        stats()
+            return the load time, size and hits of every cached model
+    Notes
+    -----
+        Cached models are shared: training a model returned by get() changes
+        the cached one, so a failed training should invalidate() it.
+    """
+    def __init__(self):
+        self.models = {}
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def _key(path):
+        # models are saved and loaded with or without the .zip extension
+        if not path.endswith('.zip'):
+            path = path + '.zip'
+        return os.path.abspath(path)
+
+
+    @staticmethod
+    def _size(model):
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in model.policy.state_dict().values()
+        )
+
+
+    def _store(self, key, model, load_sec):
+        self.models[key] = dict(
+            model = model,
+            model_class = type(model),
+            mtime = os.stat(key).st_mtime_ns,
+            load_sec = load_sec,
+            size_bytes = self._size(model),
+            hits = 0,
+        )
+        return model
+
+
+    def get(self, model_class, path, env=None):
+        """Returns the model saved at `path`
+        :param model_class: (type) stable-baselines3 algorithm of the model
+        :param path: (str) archive path, with or without the .zip extension
+        :param env: (VecEnv) environment to train the model on, if any
+        :return: (BaseAlgorithm) loaded model
+        """
+        key = self._key(path)
+        with self._lock:
+            entry = self.models.get(key)
+            if (
+                entry is None
+                or entry['model_class'] is not model_class
+                or entry['mtime'] != os.stat(key).st_mtime_ns
+                # the rollout buffer is sized for the number of envs
+                or (env is not None and env.num_envs != entry['model'].n_envs)
+            ):
+                start = time.perf_counter()
+                model = model_class.load(key, env=env)
+                return self._store(key, model, time.perf_counter() - start)
+
+            entry['hits'] += 1
+            if env is not None:
+                entry['model'].set_env(env)
+            return entry['model']
+
+
+    def put(self, model, path):
+        # `path` must have been written by model.save()
+        with self._lock:
+            self._store(self._key(path), model, 0.)
+
+
+    def invalidate(self, path):
+        with self._lock:
+            self.models.pop(self._key(path), None)
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                key: dict(
+                    load_sec = entry['load_sec'],
+                    size_bytes = entry['size_bytes'],
+                    hits = entry['hits'],
+                )
+                for key, entry in self.models.items()
+            }
+
+
+# Shared by the pages of the Streamlit app, which run in the same process
+REGISTRY = ModelRegistry()
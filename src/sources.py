@@ -0,0 +1,117 @@
+import os
+import zlib
+import numpy as np
+import pandas as pd
+
+
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+class YahooSource:
+    # Downloads daily prices from the Yahoo API
+    cacheable = True
+
+    def download(self, tic, start_date, end_date, proxy=None) -> pd.DataFrame:
+        # Ticker.history is used instead of yf.download, which keeps its
+        # results in module globals and is not safe to call from threads
+        import yfinance as yf
+        try:
+            df = yf.Ticker(tic).history(
+                start=start_date,
+                end=end_date,
+                auto_adjust=False,
+                actions=False,
+                proxy=proxy,
+                raise_errors=True,
+            )
+        except Exception as e:
+            # an empty date range is not a failure, anything else is retried
+            if "No price data found" in str(e):
+                return pd.DataFrame(columns=COLUMNS)
+            raise
+        df.index = df.index.tz_localize(None)
+        return df[COLUMNS]
+
+
+class LocalSource:
+    """Reads daily prices from a directory of `<tic>.csv` or `<tic>.parquet`
+    files, either in the Yahoo layout (Date, Open, High, Low, Close, Adj Close,
+    Volume) or with lower case names (date, open, high, low, close, volume)
+    """
+    cacheable = False
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+
+    def download(self, tic, start_date, end_date, proxy=None) -> pd.DataFrame:
+        path = os.path.join(self.data_dir, tic)
+        if os.path.exists(path + ".parquet"):
+            df = pd.read_parquet(path + ".parquet")
+        elif os.path.exists(path + ".csv"):
+            df = pd.read_csv(path + ".csv")
+        else:
+            return pd.DataFrame(columns=COLUMNS)
+
+        if "Date" not in df.columns and "date" not in df.columns:
+            df = df.reset_index()
+        df = df.rename(columns={
+            "date": "Date", "open": "Open", "high": "High", "low": "Low",
+            "close": "Close", "adjcp": "Adj Close", "volume": "Volume",
+        })
+        if "Adj Close" not in df.columns:
+            df["Adj Close"] = df["Close"]
+        df["Date"] = pd.to_datetime(df["Date"])
+        df = df.set_index("Date").sort_index()[COLUMNS]
+        return df[(df.index >= start_date) & (df.index < end_date)].copy()
+
+
+class SyntheticSource:
+    """Generates seeded geometric Brownian motion prices on business days
+    Attributes
+    ----------
+        seed: int
+            base seed, combined with the ticker name
+        mu: float
+            daily drift of the log price
+        sigma: float
+            daily volatility of the log price
+        initial_price: float
+            price at `origin`
+        origin: str
+            first date of every path, so that any date range of a ticker
+            always returns the same prices
+    """
+    cacheable = False
+
+    def __init__(self, seed=42, mu=3e-4, sigma=0.02, initial_price=100., origin="2000-01-03"):
+        self.seed = seed
+        self.mu = mu
+        self.sigma = sigma
+        self.initial_price = initial_price
+        self.origin = origin
+
+
+    def download(self, tic, start_date, end_date, proxy=None) -> pd.DataFrame:
+        dates = pd.bdate_range(self.origin, end_date, inclusive="left", name="Date")
+        rng = np.random.default_rng([self.seed, zlib.crc32(tic.encode())])
+
+        # one row of draws per day, so that a day does not depend on end_date
+        z = rng.standard_normal((len(dates), 5))
+        log_returns = self.mu - self.sigma ** 2 / 2 + self.sigma * z[:, 0]
+        close = self.initial_price * np.exp(np.cumsum(log_returns))
+        open_ = np.concatenate([[self.initial_price], close[:-1]]) * \
+            np.exp(self.sigma / 4 * z[:, 1])
+        high = np.maximum(open_, close) * (1 + np.abs(self.sigma / 2 * z[:, 2]))
+        low = np.minimum(open_, close) * (1 - np.abs(self.sigma / 2 * z[:, 3]))
+        volume = np.exp(15 + 0.5 * z[:, 4]).round()
+
+        df = pd.DataFrame(
+            np.stack([open_, high, low, close, close, volume], axis=1),
+            index=dates,
+            columns=COLUMNS,
+        )
+        return df[df.index >= start_date].copy()
+
+
+SOURCES = {"yahoo": YahooSource, "local": LocalSource, "synthetic": SyntheticSource}
@@ -0,0 +1,192 @@
+import os
+import json
+import pickle
+import hashlib
+import datetime
+import pandas as pd
+
+
+def has_sessions(start_date, end_date, calendar='NYSE'):
+    """Whether an exchange trades on a day of [start_date, end_date)
+    :param calendar: (str) pandas_market_calendars calendar name
+    :return: (bool) True as well without pandas_market_calendars, the days
+        cannot be confirmed as non-trading then
+    """
+    try:
+        import pandas_market_calendars as mcal
+    except ImportError:
+        return True
+    last = pd.Timestamp(end_date) - pd.Timedelta(days=1)
+    if last < pd.Timestamp(start_date):
+        return False
+    return len(mcal.get_calendar(calendar).valid_days(start_date, last)) > 0
+
+
+class PriceStore:
+    """Persistent on-disk OHLCV store, one Parquet file per ticker
+    Attributes
+    ----------
+        cache_dir: str
+            root directory of the store, prices are kept under `prices/`
+        calendar: str
+            exchange calendar of the tickers, see has_sessions()
+    Methods
+    -------
+        missing_ranges()
+            return the [start, end) date ranges not yet covered for a ticker
+        read()
+            read the stored rows of a ticker within [start, end)
+        write()
+            merge newly downloaded rows of a ticker into the store
+    Notes
+    -----
+        Each ticker has a `<tic>.parquet` file with the raw downloader frame
+        (Date index, Open, High, Low, Close, Adj Close, Volume) and a
+        `<tic>.json` file with the list of [start, end) ranges already fetched.
+        Ranges reaching today or later are never marked as covered, so the
+        latest (possibly incomplete) bar is always fetched again. A past
+        range without rows is only covered if the exchange calendar
+        confirms it has no trading days (weekends, holidays), an empty
+        response for trading days may be transient. A failed download
+        raises before write() and is not covered.
+    """
+    def __init__(self, cache_dir, calendar='NYSE'):
+        self.cache_dir = cache_dir
+        self.calendar = calendar
+        self.price_dir = os.path.join(cache_dir, 'prices')
+        os.makedirs(self.price_dir, exist_ok=True)
+
+
+    def _path(self, tic, ext):
+        return os.path.join(self.price_dir, f'{tic}.{ext}')
+
+
+    def _read_coverage(self, tic):
+        path = self._path(tic, 'json')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return json.load(f)
+
+
+    def _write_coverage(self, tic, ranges):
+        path = self._path(tic, 'json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(ranges, f)
+        os.replace(path + '.tmp', path)
+
+
+    def missing_ranges(self, tic, start_date, end_date):
+        missing = []
+        cursor = start_date
+        for start, end in self._read_coverage(tic):
+            if end <= cursor:
+                continue
+            if start >= end_date:
+                break
+            if start > cursor:
+                missing.append([cursor, start])
+            cursor = max(cursor, end)
+        if cursor < end_date:
+            missing.append([cursor, end_date])
+        return missing
+
+
+    def read(self, tic, start_date, end_date):
+        path = self._path(tic, 'parquet')
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        df = pd.read_parquet(path)
+        return df[(df.index >= start_date) & (df.index < end_date)].copy()
+
+
+    def write(self, tic, df, start_date, end_date):
+        path = self._path(tic, 'parquet')
+        if len(df) > 0:
+            if os.path.exists(path):
+                df = pd.concat([pd.read_parquet(path), df], axis=0)
+                # newly downloaded rows replace the stored ones
+                df = df[~df.index.duplicated(keep='last')].sort_index()
+            df.to_parquet(path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        # only completed days are marked as covered, without rows only
+        # those the exchange does not trade on
+        today = datetime.date.today().strftime('%Y-%m-%d')
+        end_date = min(end_date, today)
+        if start_date >= end_date:
+            return
+        if len(df) == 0 and has_sessions(start_date, end_date, self.calendar):
+            return
+        self._add_coverage(tic, start_date, end_date)
+
+
+    def _add_coverage(self, tic, start_date, end_date):
+        ranges = sorted(self._read_coverage(tic) + [[start_date, end_date]])
+        merged = [ranges[0]]
+        for start, end in ranges[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._write_coverage(tic, merged)
+
+
+class FeatureStore:
+    """Persistent store of rows with indicators, addressed by a hash of the
+    inputs that determine them
+    Attributes
+    ----------
+        cache_dir: str
+            root directory of the store, features are kept under `features/`
+    Methods
+    -------
+        key()
+            return the address of a set of inputs
+        read()
+            read a stored entry
+        write()
+            replace a stored entry
+    Notes
+    -----
+        An entry is one `<key>.pkl` file with the rows of all the dates
+        engineered so far, the indicator state after its last date (None
+        if the indicators are not incremental) and the end of the date
+        range it covers. The covariances depend on the
+        look back and on the requested range, they are not stored. Like
+        the prices, ranges reaching today or later are only covered up to
+        today.
+    """
+    VERSION = 4
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.feature_dir = os.path.join(cache_dir, 'features')
+        os.makedirs(self.feature_dir, exist_ok=True)
+
+
+    def key(self, **inputs):
+        inputs = dict(inputs, version=self.VERSION)
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+    def _path(self, key):
+        return os.path.join(self.feature_dir, f'{key}.pkl')
+
+
+    def read(self, key):
+        # dict(df, state, end) or None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+    def write(self, key, df, state, end_date):
+        today = datetime.date.today().strftime('%Y-%m-%d')
+        path = self._path(key)
+        entry = dict(df=df, state=state, end=min(end_date, today))
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(entry, f)
+        os.replace(path + '.tmp', path)
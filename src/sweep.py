@@ -0,0 +1,190 @@
+# Hyperparameter sweep of training trials in parallel processes
+# python -m src.sweep
+
+import os
+import json
+import time
+import random
+import hashlib
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import params, dataset, model, agent
+
+
+# Values tried for each model_params / train_params / run_params key
+SPACE = dict(
+    learning_rate = [1e-4, 3e-4, 1e-3],
+    batch_size = [2 ** 1, 2 ** 4, 2 ** 6],
+    n_epochs = [1, 5, 10],
+    n_steps = [2 ** 8, 2 ** 10],
+)
+
+DATE = ['2018-01-01', '2023-01-01']
+CHECK_FREQ = 2 ** 11  # timesteps between early stopping checks of every trial
+
+
+def trials(space, n_trials=None, seed=42):
+    """Parameter sets of a sweep
+    :param space: (dict) parameter name -> list of values
+    :param n_trials: (int) number of sets sampled from the grid (None: all)
+    :return: (list) dicts of parameters, in a reproducible order
+    """
+    grid = [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    if n_trials is not None and n_trials < len(grid):
+        grid = random.Random(seed).sample(grid, n_trials)
+    return grid
+
+
+def trial_id(trial):
+    return hashlib.sha1(json.dumps(trial, sort_keys=True).encode()).hexdigest()[:10]
+
+
+def median_curve(histories):
+    # Median mean reward of the trials at each check, the checks of all
+    # trials being at the same timesteps
+    length = max((len(h) for h in histories), default=0)
+    return [
+        float(np.median([h[i] for h in histories if len(h) > i]))
+        for i in range(length)
+    ]
+
+
+def read_results(path):
+    if path is None or not os.path.exists(path):
+        return pd.DataFrame()
+    # trial ids are hex digests, some of them all digits
+    return pd.read_csv(path, dtype={'trial': str})
+
+
+def run_trial(spec, trial, env_kwargs, model_params, train_params, run_params, model_name,
+              reference=None, check_freq=CHECK_FREQ, save_dir=None):
+    # Trains one trial in a worker process on the shared dataset
+    import torch
+    from src.callbacks import EarlyStoppingCallback
+
+    # the trials already use every core
+    torch.set_num_threads(1)
+
+    model_params = dict(model_params)
+    train_params = dict(train_params)
+    run_params = dict(run_params)
+    for key, value in trial.items():
+        if key in model_params:
+            model_params[key] = value
+        elif key in train_params:
+            train_params[key] = value
+        elif key in run_params:
+            run_params[key] = value
+        else:
+            raise ValueError(f"unknown parameter {key}")
+
+    # the trials are already processes, environment copies are batched
+    # instead of subprocesses
+    n_envs = run_params['n_envs']
+    env = model.make_shared_env(spec, dict(env_kwargs, record = False))
+    if n_envs > 1:
+        env_train, _ = env.get_sb_vec_env(n_envs, max_start_day=run_params['max_start_day'], seed=model_params['seed'])
+    else:
+        env_train, _ = env.get_sb_env()
+
+    early_stopping = EarlyStoppingCallback(
+        check_freq = check_freq,
+        reference = reference,
+    )
+    my_agent = agent.Agent(env = env_train)
+    start = time.perf_counter()
+    trained = my_agent.train(
+        model = my_agent.get_model(model_name, model_params),
+        train_kwargs = dict(train_params, tb_log_name = f'sweep_{trial_id(trial)}', progress_bar = False),
+        callbacks = [early_stopping],
+    )
+    if save_dir is not None:
+        trained.save(os.path.join(save_dir, trial_id(trial)))
+
+    history = early_stopping.history
+    return dict(
+        trial = trial_id(trial),
+        **trial,
+        status = 'stopped' if early_stopping.stopped else 'completed',
+        timesteps = trained.num_timesteps,
+        check_freq = check_freq,
+        seconds = time.perf_counter() - start,
+        final_reward = history[-1] if history else np.nan,
+        best_reward = max(history) if history else np.nan,
+        history = json.dumps(history),
+    )
+
+
+def main(data_params, env_kwargs, model_params, train_params, run_params, model_name, date,
+         space=SPACE, n_trials=None, results_path='sweep.csv', max_workers=None,
+         check_freq=CHECK_FREQ, save_dir=None):
+    """Runs the trials of a sweep that are not in the results file yet
+    :param space: (dict) model_params / train_params / run_params key ->
+        values to try
+    :param n_trials: (int) number of sampled parameter sets (None: grid)
+    :param results_path: (str) CSV file, rewritten after every finished trial
+    :param max_workers: (int) number of processes (None: all cores)
+    :param check_freq: (int) timesteps between early stopping checks, the
+        same for every trial, a trial stops when its mean reward is below
+        the median of the finished trials at the same check
+    :param save_dir: (str) directory of the trained models (None: not saved)
+    :return: (df) results of all the trials, best final reward first
+    """
+    results = read_results(results_path)
+    done = set(results['trial']) if len(results) else set()
+    todo = [t for t in trials(space, n_trials) if trial_id(t) not in done]
+    # only the histories checked at the same timesteps are comparable
+    histories = [
+        json.loads(h) for h, freq in zip(results['history'], results['check_freq'])
+        if freq == check_freq
+    ] if 'check_freq' in results else []
+    if not todo:
+        return results.sort_values('final_reward', ascending=False, ignore_index=True)
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+
+    # Get training data, once for all the trials
+    arrays = dataset.arrays(data_params, env_kwargs, date)
+    shared = model.SharedArrays(arrays)
+
+    n_workers = max_workers or os.cpu_count()
+    pending = list(todo)
+    try:
+        with ProcessPoolExecutor(n_workers) as executor:
+            def submit():
+                # trials compare against those finished when they are submitted
+                return executor.submit(
+                    run_trial, shared.spec, pending.pop(0), env_kwargs, model_params,
+                    train_params, run_params, model_name, median_curve(histories),
+                    check_freq, save_dir,
+                )
+
+            futures = {submit() for _ in range(min(n_workers, len(pending)))}
+            while futures:
+                future = next(as_completed(futures))
+                futures.remove(future)
+                row = future.result()
+                histories.append(json.loads(row['history']))
+                results = pd.concat([results, pd.DataFrame([row])], ignore_index=True)
+
+                # saved as soon as a trial finishes, to resume after an interruption
+                if results_path is not None:
+                    results.to_csv(results_path + '.tmp', index=False)
+                    os.replace(results_path + '.tmp', results_path)
+
+                if pending:
+                    futures.add(submit())
+    finally:
+        shared.close()
+
+    return results.sort_values('final_reward', ascending=False, ignore_index=True)
+
+
+if __name__ == '__main__':
+    data_params, env_params, model_params, train_params, run_params, model_name = params.main()
+    print(main(
+        data_params, env_params, model_params, train_params, run_params, model_name, DATE,
+    ).to_string())
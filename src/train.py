@@ -1,43 +1,120 @@
 import os
-from stable_baselines3 import PPO
+import json
+import hashlib
 
-from src import params, data, model, agent
+from src import params, dataset, model, agent, export
+from src.callbacks import CheckpointCallback, checkpoints, remove_checkpoints, save_atomic
+from src.registry import REGISTRY
 
 
-def main(data_params, env_kwargs, model_params, train_params, model_name, date):
-    # Get training data
-    df = data.main(
-        stocks = data_params['stocks'],
-        date = date,
-        # mode = 'train',
+def fingerprint(data_params, env_kwargs, model_params, train_params, run_params, model_name, date):
+    """Identifies a training job, so that it only resumes from its own
+    checkpoints
+    :return: (str) hash of the dates, data, parameters and the model
+        trained from
+    """
+    path = os.path.join('src', model_name) + '.zip'
+    base = None
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            base = hashlib.sha1(f.read()).hexdigest()
+    job = dict(
+        date = list(date),
+        stocks = sorted(data_params['stocks']),
+        source = data_params['source'],
+        source_kwargs = data_params['source_kwargs'],
+        lookback = data_params['lookback'],
+        incremental_indicators = data_params['incremental_indicators'],
+        warmup_years = data_params['warmup_years'],
+        env_kwargs = env_kwargs,
+        model_params = model_params,
+        train_params = {k: v for k, v in train_params.items() if k != 'progress_bar'},
+        # where and how many checkpoints are kept does not change the job
+        run_params = {
+            k: v for k, v in run_params.items()
+            if k not in ('checkpoint_dir', 'keep_checkpoints')
+        },
+        base = base,
     )
+    return hashlib.sha1(json.dumps(job, sort_keys=True, default=str).encode()).hexdigest()[:10]
 
+
+def main(data_params, env_kwargs, model_params, train_params, run_params, model_name, date):
     # Create environment
+    # Episode memories are not needed while training
+    # The training dataset is mapped if data_params['dataset_dir'] is set,
+    # built on the first run of this range
     train_env = model.StockPortfolioEnv(
-        df = df,
-        **env_kwargs)
-    
-    env_train, _ = train_env.get_sb_env()
-
-    # Define PPO agent
-    my_agent = agent.Agent(
-        env = env_train,
-    )
+        df = None,
+        arrays = dataset.arrays(data_params, env_kwargs, date),
+        **dict(env_kwargs, record = False))
 
-    # model_ppo = my_agent.get_model(
-    #     model_name = model_name,
-    #     model_kwargs = model_params,
-    # )
+    # Checkpoints of another job (dates, data, parameters or base model)
+    # have another prefix and are not resumed from
+    job = fingerprint(
+        data_params, env_kwargs, model_params, train_params, run_params, model_name, date)
+    prefix = f'{os.path.basename(model_name)}_{job}'
 
-    model_ppo = PPO.load(
-        os.path.join('src', model_name),
-        env=env_train,
-        # **model_params,
-    )
+    # copied, a resumed training only runs its remaining timesteps
+    train_params = dict(train_params)
+    checkpoint_freq = run_params['checkpoint_freq']
+    checkpoint_dir = run_params['checkpoint_dir']
 
-    trained_ppo = my_agent.train(
-        model = model_ppo,
-        train_kwargs = train_params 
-    )
+    n_envs, vec_env = run_params['n_envs'], run_params['vec_env']
+    if n_envs > 1 and vec_env == 'subproc':
+        env_train, _ = train_env.get_sb_subproc_env(n_envs)
+    elif n_envs > 1:
+        env_train, _ = train_env.get_sb_vec_env(
+            n_envs, max_start_day=run_params['max_start_day'], seed=model_params['seed'])
+    else:
+        env_train, _ = train_env.get_sb_env()
+
+    try:
+        # Define PPO agent
+        my_agent = agent.Agent(
+            env = env_train,
+        )
+
+        # model_ppo = my_agent.get_model(
+        #     model_name = model_name,
+        #     model_kwargs = model_params,
+        # )
+
+        # Resume an interrupted training from its latest checkpoint
+        found = checkpoints(checkpoint_dir, prefix) if checkpoint_freq else []
+        if found:
+            steps, path = found[-1]
+            model_ppo = agent.MODELS['ppo'].load(path, env=env_train)
+            train_params['total_timesteps'] = max(train_params['total_timesteps'] - steps, 0)
+            train_params['reset_num_timesteps'] = False
+        else:
+            model_ppo = REGISTRY.get(
+                agent.MODELS['ppo'],
+                os.path.join('src', model_name),
+                env=env_train,
+                # **model_params,
+            )
+
+        trained_ppo = my_agent.train(
+            model = model_ppo,
+            train_kwargs = train_params,
+            callbacks = [
+                CheckpointCallback(checkpoint_freq, checkpoint_dir, prefix, run_params['keep_checkpoints'])
+            ] if checkpoint_freq else [],
+        )
+    except BaseException:
+        # the cached model may be partly trained
+        REGISTRY.invalidate(os.path.join('src', model_name))
+        raise
+    finally:
+        if n_envs > 1 and vec_env == 'subproc':
+            env_train.close()
+            train_env.shared_arrays.close()
 
-    trained_ppo.save(os.path.join('src', model_name))
+    save_atomic(trained_ppo, os.path.join('src', model_name))
+    remove_checkpoints(checkpoint_dir, prefix)
+    REGISTRY.put(trained_ppo, os.path.join('src', model_name))
+    # predict.main() falls back to the model without a matching export
+    diff = export.export_checked(trained_ppo, os.path.join('src', model_name))
+    if diff > export.TOL:
+        print(f'exported policy differs from the model by {diff:.2e}, not used')
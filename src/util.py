@@ -1,3 +1,4 @@
+import numpy as np
 from PIL import Image
 import streamlit as st
 
@@ -36,6 +37,22 @@ def get_favicon():
     return image
 
 
+def discount_factors(n_months, discount_rate):
+    # Present value of 1 recovered 0 ... n_months - 1 months after write-off
+    return (1 + discount_rate) ** (-np.arange(n_months) / 12)
+
+
+def discount(amounts, discount_rate):
+    """Discounts cumulative monthly amounts, all the accounts at once
+    :param amounts: (np.ndarray) [accounts x months] cumulative amounts,
+        month 0 first
+    :param discount_rate: (float) annual discount rate, e.g. 0.036
+    :return: (np.ndarray) [accounts x months] cumulative discounted amounts
+    """
+    marginal = np.diff(amounts, axis=1, prepend=0)
+    return np.cumsum(marginal * discount_factors(amounts.shape[1], discount_rate), axis=1)
+
+
 def human_format(num):
     num = float('{:.3g}'.format(num))
     magnitude = 0
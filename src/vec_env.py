@@ -0,0 +1,137 @@
+import gymnasium
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+
+from src.model import softmax
+
+
+class StockPortfolioVecEnv(VecEnv):
+    """Simulates independent episodes of a StockPortfolioEnv with batched
+    NumPy operations, one row per episode
+    Attributes
+    ----------
+        env: StockPortfolioEnv
+            environment whose arrays and parameters are shared
+        n_envs: int
+            number of episodes simulated at once
+        max_start_day: int
+            episodes start at a random day in [0, max_start_day],
+            0 starts every episode at the first day like StockPortfolioEnv
+        seed: int
+            seed of the random start days
+    Notes
+    -----
+        Episodes follow StockPortfolioEnv.step(): the step at the last day
+        only returns done with the previous reward, then the episode is
+        reset and its last observation is kept in info["terminal_observation"].
+        Episode memories are not recorded.
+    """
+    def __init__(self, env, n_envs, max_start_day=0, seed=None):
+        self.env = env
+        self.n_days = env.n_days
+        self.max_start_day = min(max_start_day, env.n_days - 1)
+        self.closes = env.closes
+        # not copied if already float32, e.g. a memory-mapped dataset
+        self.obs = np.asarray(env.obs, dtype=np.float32)
+        self.initial_allocation = np.asarray(env.initial_allocation, dtype=float)
+        self.rng = np.random.default_rng(seed)
+        self.render_mode = None
+
+        super().__init__(
+            num_envs = n_envs,
+            observation_space = gymnasium.spaces.Box(
+                low=-np.inf, high=np.inf, shape=env.observation_space.shape
+            ),
+            action_space = gymnasium.spaces.Box(
+                low=0, high=1, shape=env.action_space.shape
+            ),
+        )
+
+        self.day = np.zeros(n_envs, dtype=int)
+        self.portfolio_value = np.full(n_envs, float(env.initial_amount))
+        self.last_allocation = np.tile(self.initial_allocation, (n_envs, 1))
+        self.reward = np.zeros(n_envs)
+        self.actions = None
+
+
+    def _reset_envs(self, indices):
+        self.day[indices] = self.rng.integers(0, self.max_start_day + 1, len(indices))
+        self.portfolio_value[indices] = self.env.initial_amount
+        self.last_allocation[indices] = self.initial_allocation
+
+
+    def reset(self):
+        self._reset_envs(np.arange(self.num_envs))
+        self.reward[:] = 0
+        return self.obs[self.day]
+
+
+    def step_async(self, actions):
+        self.actions = actions
+
+
+    def step_wait(self):
+        terminal = self.day >= self.n_days - 1
+        live = ~terminal
+
+        actions = np.asarray(self.actions, dtype=float).reshape(self.num_envs, -1)
+        allocation = softmax(actions)
+
+        # load next state
+        last_day = self.day.copy()
+        self.day[live] += 1
+
+        # Ratio of portfolio return (in [-1, 1])
+        return_ratio = np.sum(
+            (self.closes[self.day] / self.closes[last_day] - 1) * allocation, axis=1)
+
+        # Calculate commission fee
+        commission_fee = self.env.commission_perc / 100 * self.portfolio_value * \
+            np.sum(np.abs(allocation - self.last_allocation), axis=1)
+        commission_ratio = commission_fee / self.portfolio_value
+
+        # New portfolio value and reward [%], terminal episodes keep the last ones
+        self.portfolio_value = np.where(
+            live, self.portfolio_value * (1 + return_ratio) - commission_fee, self.portfolio_value)
+        self.reward = np.where(
+            live, self.env.reward_scaling * (return_ratio - commission_ratio) * 100, self.reward)
+        self.last_allocation[live] = allocation[live]
+
+        obs = self.obs[self.day]
+        infos = [{} for _ in range(self.num_envs)]
+        done_indices = np.flatnonzero(terminal)
+        if len(done_indices) > 0:
+            for i in done_indices:
+                infos[i]["terminal_observation"] = obs[i].copy()
+            self._reset_envs(done_indices)
+            obs[done_indices] = self.obs[self.day[done_indices]]
+
+        return obs, self.reward.astype(np.float32), terminal, infos
+
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+
+    def close(self):
+        pass
+
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name)] * len(self._get_indices(indices))
+
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [
+            getattr(self, method_name)(*method_args, **method_kwargs)
+            for _ in self._get_indices(indices)
+        ]
+
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from src import params
+
+
+@pytest.fixture
+def env_kwargs():
+    _, env_params, _, _, _, _ = params.main()
+    return dict(env_params, commission_perc=0.5)
+
+
+@pytest.fixture
+def arrays(env_kwargs):
+    # Arrays of StockPortfolioEnv(arrays=...) of a random market, like
+    # model.market_arrays() builds them
+    rng = np.random.default_rng(0)
+    n_days, n_stocks = 60, env_kwargs['stock_dim']
+    n_techs = len(env_kwargs['tech_indicator_list'])
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (n_days, n_stocks)), axis=0))
+    obs = rng.normal(size=(n_days, n_stocks + n_techs, n_stocks)).astype(np.float32)
+    return dict(
+        dates = np.array([f'day_{i:03d}' for i in range(n_days)], dtype=object),
+        tics = np.array([f'TIC{i}' for i in range(n_stocks)], dtype=object),
+        closes = closes,
+        obs = obs,
+        covs = obs[:, :n_stocks],
+    )
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from src import backtest, model
+
+
+@pytest.mark.parametrize('initial', ['env', 'uniform'])
+def test_simulate_matches_env_step(arrays, env_kwargs, initial):
+    if initial == 'uniform':
+        n_stocks = env_kwargs['stock_dim']
+        env_kwargs = dict(env_kwargs, initial_allocation=[1 / n_stocks] * n_stocks)
+    env = model.StockPortfolioEnv(df=None, arrays=arrays, **env_kwargs)
+    rng = np.random.default_rng(1)
+    actions = rng.normal(0, 1, (env.n_days - 1, env.stock_dim))
+
+    env.reset()
+    commission = [0.]
+    for action in actions:
+        value = env.portfolio_value
+        env.step(action)
+        # the env does not keep its fees, they are what the return does not explain
+        commission.append(value * (1 + env.portfolio_return_memory[-1]) - env.portfolio_value)
+
+    episode = backtest.simulate(
+        model.softmax(actions), env.closes, env.initial_amount,
+        env.initial_allocation, env.commission_perc,
+    )
+    np.testing.assert_allclose(episode['value'], env.asset_memory, rtol=1e-12)
+    np.testing.assert_allclose(episode['daily_return'], env.portfolio_return_memory, atol=1e-15)
+    np.testing.assert_allclose(episode['commission'], commission, rtol=1e-9, atol=1e-12)
+    assert episode['commission'][1:].min() > 0
+
+
+def test_simulate_batches_episodes(arrays, env_kwargs):
+    # leading axes of the allocations are independent episodes
+    rng = np.random.default_rng(2)
+    allocations = model.softmax(rng.normal(size=(3, len(arrays['closes']) - 1, env_kwargs['stock_dim'])))
+    args = (arrays['closes'], env_kwargs['initial_amount'],
+            env_kwargs['initial_allocation'], env_kwargs['commission_perc'])
+
+    batch = backtest.simulate(allocations, *args)
+    for i in range(len(allocations)):
+        single = backtest.simulate(allocations[i], *args)
+        for name in single:
+            np.testing.assert_allclose(batch[name][i], single[name])
+
+
+def test_min_variance_falls_back_to_equal_weights():
+    covs = np.stack([
+        np.array([[1., 0.], [0., 4.]]),
+        np.zeros((2, 2)),  # singular, every weight is 0 / 0
+        np.array([[1., 0.], [0., 4.]]),
+    ])
+    weights = backtest.min_variance(covs)
+
+    assert not np.isnan(weights).any()
+    np.testing.assert_allclose(weights.sum(axis=1), 1)
+    np.testing.assert_allclose(weights[0], [0.8, 0.2])
+    np.testing.assert_allclose(weights[1], [0.5, 0.5])
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from torch import nn
+from stable_baselines3 import PPO
+
+from src import export, model
+
+
+@pytest.fixture(params=[nn.Tanh, nn.ReLU])
+def ppo(request, arrays, env_kwargs):
+    # A small PPO model trained for a few steps, so that its action layer
+    # has moved away from its initialization
+    env, _ = model.StockPortfolioEnv(df=None, arrays=arrays, **env_kwargs).get_sb_env()
+    ppo = PPO(
+        'MlpPolicy', env, n_steps=32, batch_size=16, n_epochs=2, seed=0,
+        policy_kwargs=dict(net_arch=[16, 16], activation_fn=request.param),
+    )
+    return ppo.learn(64)
+
+
+def test_numpy_policy_matches_model(ppo, tmp_path):
+    path = str(tmp_path / 'ppo')
+    ppo.save(path)
+    export.export_policy(ppo, path)
+    policy = export.load(path)
+    assert policy is not None
+
+    rng = np.random.default_rng(0)
+    obs = rng.normal(size=(256,) + ppo.observation_space.shape).astype(np.float32)
+    expected, _ = ppo.predict(obs, deterministic=True)
+    actions, _ = policy.predict(obs, deterministic=True)
+    assert actions.shape == expected.shape
+    np.testing.assert_allclose(actions, expected, atol=export.TOL)
+
+    # a single observation gives a single action
+    expected, _ = ppo.predict(obs[0], deterministic=True)
+    actions, _ = policy.predict(obs[0], deterministic=True)
+    assert actions.shape == expected.shape
+    np.testing.assert_allclose(actions, expected, atol=export.TOL)
+
+
+def test_export_checked_keeps_matching_policy(ppo, tmp_path):
+    path = str(tmp_path / 'ppo')
+    ppo.save(path)
+    assert export.export_checked(ppo, path) <= export.TOL
+    assert export.load(path) is not None
+
+
+def test_load_ignores_policy_of_changed_model(ppo, tmp_path):
+    path = str(tmp_path / 'ppo')
+    ppo.save(path)
+    export.export_policy(ppo, path)
+    ppo.learn(32)
+    ppo.save(path)
+    assert export.load(path) is None